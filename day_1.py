@@ -1,26 +1,167 @@
 """Solution for https://adventofcode.com/2019/day/1/"""
 from argparse import ArgumentParser
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import doctest
+from itertools import islice
+import json
 from math import floor
+import mmap
+from multiprocessing import shared_memory
+import os
 from pathlib import Path
-from typing import List
+from typing import ClassVar, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from profiling import StageTimings, add_profiling_args
 
 DEFAULT_INPUT_FILE_PATH = "input_1.txt"
 
 
 def main_1(module_masses: List[int]) -> int:
-    return sum([fuel_requirement(mod_mass) for mod_mass in module_masses])
+    return sum(fuel_requirement(mod_mass) for mod_mass in module_masses)
 
 
 def main_2(module_masses: List[int]) -> int:
     return sum(
-        [
-            fuel_requirement(mod_mass, add_fuel_for_fuel=True)
-            for mod_mass in module_masses
-        ]
+        fuel_requirement(mod_mass, add_fuel_for_fuel=True)
+        for mod_mass in module_masses
     )
 
 
+class FuelTotals:
+    """Running totals for both parts, can be saved to and loaded from a checkpoint file"""
+
+    def __init__(self, records: int = 0, fuel: int = 0, fuel_with_fuel: int = 0):
+        self.records: int = records
+        self.fuel: int = fuel
+        self.fuel_with_fuel: int = fuel_with_fuel
+
+    def add(self, module_mass: int) -> None:
+        self.records += 1
+        self.fuel += fuel_requirement(module_mass)
+        self.fuel_with_fuel += fuel_requirement(module_mass, add_fuel_for_fuel=True)
+
+    def save(self, checkpoint_path: Path) -> None:
+        # write then rename so an interruption never leaves half a checkpoint
+        tmp_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(self.__dict__))
+        os.replace(tmp_path, checkpoint_path)
+
+    @classmethod
+    def load(cls, checkpoint_path: Path) -> "FuelTotals":
+        if not checkpoint_path.exists():
+            return cls()
+        return cls(**json.loads(checkpoint_path.read_text()))
+
+
+def stream_fuel_totals(
+    masses: Iterable[Union[int, str]],
+    checkpoint_path: Optional[Path] = None,
+    checkpoint_every: int = 10000,
+) -> FuelTotals:
+    """Fold a stream of masses into totals for both parts in constant memory
+
+    `masses` can be any iterable of ints or lines of text, such as an open file. When a
+    checkpoint path is given the totals are saved every `checkpoint_every` records and at
+    the end. If that checkpoint already exists, the records it covers are skipped without
+    being computed again and counting picks up where it left off.
+
+    >>> import io, tempfile
+    >>> totals = stream_fuel_totals(io.StringIO("12\\n14\\n\\n1969\\n100756\\n"))
+    >>> totals.records, totals.fuel, totals.fuel_with_fuel
+    (4, 34241, 51316)
+    >>> checkpoint = Path(tempfile.mkdtemp()) / "checkpoint.json"
+    >>> totals = stream_fuel_totals([12, 14], checkpoint, checkpoint_every=1)
+    >>> totals = stream_fuel_totals([12, 14, 1969, 100756], checkpoint)
+    >>> totals.records, totals.fuel, totals.fuel_with_fuel
+    (4, 34241, 51316)
+
+    :param masses: Iterable of module masses
+    :param checkpoint_path: Optional[Path], file to save totals to and resume from
+    :param checkpoint_every: int, number of records between checkpoints
+    :return: FuelTotals
+    """
+    totals = FuelTotals()
+    mass_iter: Iterator[int] = _iter_masses(masses)
+    if checkpoint_path:
+        totals = FuelTotals.load(checkpoint_path)
+        mass_iter = islice(mass_iter, totals.records, None)
+    for module_mass in mass_iter:
+        totals.add(module_mass)
+        if checkpoint_path and totals.records % checkpoint_every == 0:
+            totals.save(checkpoint_path)
+    if checkpoint_path:
+        totals.save(checkpoint_path)
+    return totals
+
+
+def _iter_masses(masses: Iterable[Union[int, str]]) -> Iterator[int]:
+    for mod_mass in masses:
+        if isinstance(mod_mass, str):
+            mod_mass = mod_mass.strip()
+            if not mod_mass:
+                continue
+        yield int(mod_mass)
+
+
+def parallel_fuel_totals(module_masses: List[int], workers: int) -> Tuple[int, int]:
+    """Compute the answers for both parts by splitting the masses across processes
+
+    The masses are copied once into a shared memory int64 buffer, each worker reads
+    its own slice of that buffer directly so nothing but the slice bounds is pickled.
+
+    >>> parallel_fuel_totals([12, 14, 1969, 100756], workers=3)
+    (34241, 51316)
+    >>> parallel_fuel_totals([], workers=2)
+    (0, 0)
+
+    :param module_masses: List[int], masses of the modules
+    :param workers: int, number of processes to compute with
+    :return: Tuple[int, int], answers for part 1 and part 2
+    """
+    num_masses: int = len(module_masses)
+    if not num_masses:
+        return 0, 0
+    shm = shared_memory.SharedMemory(create=True, size=num_masses * 8)
+    try:
+        shm.buf[: num_masses * 8] = array("q", module_masses).tobytes()
+        slice_size, extra = divmod(num_masses, workers)
+        bounds: List[Tuple[int, int]] = []
+        start: int = 0
+        for i in range(min(workers, num_masses)):
+            end = start + slice_size + (1 if i < extra else 0)
+            bounds.append((start, end))
+            start = end
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            partial_sums = executor.map(
+                _fuel_totals_for_slice,
+                [shm.name] * len(bounds),
+                [s_start for s_start, _ in bounds],
+                [s_end for _, s_end in bounds],
+            )
+            fuel_sums, fuel_with_fuel_sums = zip(*partial_sums)
+        return sum(fuel_sums), sum(fuel_with_fuel_sums)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _fuel_totals_for_slice(shm_name: str, start: int, end: int) -> Tuple[int, int]:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    masses = shm.buf.cast("q")
+    try:
+        fuel: int = 0
+        fuel_with_fuel: int = 0
+        for mod_mass in masses[start:end]:
+            fuel += fuel_requirement(mod_mass)
+            fuel_with_fuel += fuel_requirement(mod_mass, add_fuel_for_fuel=True)
+        return fuel, fuel_with_fuel
+    finally:
+        # the view has to be let go of before the block can be closed
+        masses.release()
+        shm.close()
+
+
 def parse_input(input_path: Path) -> List[int]:
     if not input_path.exists():
         print(f"Bad input path. '{input_path}' does not exist.")
@@ -34,6 +175,70 @@ def parse_input(input_path: Path) -> List[int]:
     return module_masses
 
 
+class FuelTable:
+    """Lookup table of total fuel, including fuel for fuel, for every mass below a bound
+
+    Built bottom-up with T[m] = f(m) + T[f(m)] where f(m) is the fuel for mass m,
+    which works b/c f(m) is always smaller than m. Saved as raw int64 values so that
+    loading only maps the file into memory.
+
+    >>> table = FuelTable.build(2 ** 17)
+    >>> table[100756], table[14], len(table)
+    (50346, 2, 131072)
+    """
+
+    active: ClassVar[Optional["FuelTable"]] = None
+
+    def __init__(self, values: Sequence[int], mapped_file: Optional[mmap.mmap] = None):
+        self.values: Sequence[int] = values
+        self._mapped_file: Optional[mmap.mmap] = mapped_file
+
+    @classmethod
+    def set_active(cls, table: Optional["FuelTable"]) -> None:
+        """Make fuel_requirement use this table, or stop using one if None"""
+        cls.active = table
+
+    @classmethod
+    def build(cls, bound: int = 2 ** 20) -> "FuelTable":
+        values = array("q", bytes(8 * bound))
+        for mod_mass in range(bound):
+            fuel_required: int = mod_mass // 3 - 2
+            if fuel_required > 0:
+                values[mod_mass] = fuel_required + values[fuel_required]
+        return cls(values)
+
+    def save(self, table_path: Path) -> None:
+        with table_path.open("wb") as table_file:
+            table_file.write(memoryview(self.values).cast("B"))
+
+    @classmethod
+    def load(cls, table_path: Path) -> "FuelTable":
+        """
+        >>> import tempfile
+        >>> table_path = Path(tempfile.mkdtemp()) / "fuel_table.bin"
+        >>> FuelTable.build(2000).save(table_path)
+        >>> table = FuelTable.load(table_path)
+        >>> table[1969], len(table)
+        (966, 2000)
+        >>> table.close()
+        """
+        with table_path.open("rb") as table_file:
+            mapped_file = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(memoryview(mapped_file).cast("q"), mapped_file)
+
+    def close(self) -> None:
+        if self._mapped_file is not None:
+            self.values.release()
+            self._mapped_file.close()
+            self._mapped_file = None
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, mod_mass: int) -> int:
+        return self.values[mod_mass]
+
+
 def fuel_requirement(module_mass: int, add_fuel_for_fuel: bool = False) -> int:
     """
 
@@ -53,11 +258,21 @@ def fuel_requirement(module_mass: int, add_fuel_for_fuel: bool = False) -> int:
     >>> fuel_requirement(100756, add_fuel_for_fuel=True)
     50346
 
+    >>> FuelTable.set_active(FuelTable.build(1000))
+    >>> fuel_requirement(654, add_fuel_for_fuel=True)
+    312
+    >>> fuel_requirement(1969, add_fuel_for_fuel=True)
+    966
+    >>> FuelTable.set_active(None)
+
     :param module_mass: int, mass of the module
     :param add_fuel_for_fuel: bool, default False, whether to recursively
         calculate fuel required for weight of fuel added
     :return: int, amount of fuel required
     """
+    table = FuelTable.active
+    if add_fuel_for_fuel and table is not None and 0 <= module_mass < len(table):
+        return table.values[module_mass]
     fuel_required: int = floor(module_mass / 3) - 2
     if not add_fuel_for_fuel:
         return fuel_required
@@ -75,6 +290,39 @@ def build_arg_parser() -> ArgumentParser:
     arg_parser.add_argument(
         "-t", "--test", help="Run the tests for this solution", action="store_true"
     )
+    arg_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Compute both parts using this many processes",
+    )
+    arg_parser.add_argument(
+        "--fuel-table",
+        help="Path for precomputed fuel table, built and saved if it does not exist",
+    )
+    arg_parser.add_argument(
+        "--fuel-table-bound",
+        type=int,
+        default=2 ** 20,
+        help="Masses below this are looked up in the fuel table",
+    )
+    arg_parser.add_argument(
+        "-s",
+        "--stream",
+        help="Stream the input file instead of loading it all",
+        action="store_true",
+    )
+    arg_parser.add_argument(
+        "-c", "--checkpoint", help="Path for checkpoint file when streaming"
+    )
+    arg_parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=10000,
+        help="Number of records between checkpoints",
+    )
+    add_profiling_args(arg_parser)
     return arg_parser
 
 
@@ -89,18 +337,55 @@ def run(arg_parser: ArgumentParser) -> None:
         else:
             return
 
+    if args.fuel_table:
+        table_path = Path(args.fuel_table)
+        if not table_path.exists():
+            print("Building fuel table...")
+            FuelTable.build(args.fuel_table_bound).save(table_path)
+        FuelTable.set_active(FuelTable.load(table_path))
+
+    if args.stream:
+        input_path = Path(args.input)
+        if not input_path.exists():
+            print(f"Bad input path. '{input_path}' does not exist.")
+            return
+        timings = StageTimings.from_args(Path(__file__).stem, args)
+        print("Streaming input...")
+        checkpoint_path = Path(args.checkpoint) if args.checkpoint else None
+        with timings.stage("parts"), input_path.open() as input_file:
+            totals = stream_fuel_totals(
+                input_file, checkpoint_path, args.checkpoint_every
+            )
+        print(f"Answer for part 1: {totals.fuel}")
+        print(f"Answer for part 2: {totals.fuel_with_fuel}")
+        timings.report()
+        return
+
     if not args.test or args.run:
+        timings = StageTimings.from_args(Path(__file__).stem, args)
         print("Parsing input...")
-        parsed_input = parse_input(Path(args.input))
+        with timings.stage("parse"):
+            parsed_input = parse_input(Path(args.input))
         if not parsed_input:
             print("Could not parse input.")
             return
+        if args.workers > 1:
+            print(f"Computing answers with {args.workers} workers...")
+            with timings.stage("parts"):
+                answer_1, answer_2 = parallel_fuel_totals(parsed_input, args.workers)
+            print(f"Answer for part 1: {answer_1}")
+            print(f"Answer for part 2: {answer_2}")
+            timings.report()
+            return
         print("Computing answer for part 1...")
-        answer_1 = main_1(parsed_input)
+        with timings.stage("part_1"):
+            answer_1 = main_1(parsed_input)
         print(f"Answer for part 1: {answer_1}")
         print("Computing answer for part 2...")
-        answer_2 = main_2(parsed_input)
+        with timings.stage("part_2"):
+            answer_2 = main_2(parsed_input)
         print(f"Answer for part 2: {answer_2}")
+        timings.report()
 
 
 if __name__ == "__main__":
@@ -1,8 +1,12 @@
 """Solution for https://adventofcode.com/2019/day/2/"""
 from argparse import ArgumentParser
+import copy
 import doctest
 from pathlib import Path
-from typing import List
+import time
+from typing import List, Optional, Tuple
+
+from profiling import StageTimings, add_profiling_args
 
 DEFAULT_INPUT_FILE_PATH = "input_2.txt"
 
@@ -15,6 +19,10 @@ class EndOfProgramError(Exception):
     pass
 
 
+class InfiniteLoopError(Exception):
+    pass
+
+
 def main_1(parsed_input) -> int:
     icp = IntCodeProgram(parsed_input)
     icp.command_list[1] = 12
@@ -42,43 +50,158 @@ def main_2(parsed_input) -> int:
                 return 100 * i + j
 
 
+class LoopDetector:
+    """Brent's cycle detection over the states a program passes through
+
+    Only one state is kept, and it is swapped for the current one after 1, 2, 4, 8...
+    more steps, so memory stays constant however long the program runs. A program that
+    repeats a state is caught within about twice the steps it takes to get back to it.
+
+    >>> detector = LoopDetector()
+    >>> [detector.check(state) for state in [0, 1, 2, 3, 4, 2, 3, 4, 2, 3, 4]]
+    [False, False, False, False, False, True, False, False, False, False, True]
+    """
+
+    def __init__(self):
+        self.saved_state: Optional[Tuple[int, int]] = None
+        self.power: int = 1
+        self.num_steps: int = 0
+
+    def check(self, state: Tuple[int, int]) -> bool:
+        """Record the state, True if it matches the saved one
+
+        States hold a hash of memory, so a match means the program has been in the same
+        state before unless two different memories hashed the same.
+        """
+        if state == self.saved_state:
+            return True
+        self.num_steps += 1
+        if self.num_steps == self.power:
+            self.saved_state = state
+            self.power *= 2
+            self.num_steps = 0
+        return False
+
+
 class IntCodeProgram:
     command_map: dict = {1: "execute_add", 2: "execute_multiply", 99: "set_exit"}
 
-    def __init__(self, command_list: List[int]):
+    def __init__(self, command_list: List[int], detect_loops: bool = False):
         # so we don't modify the input list in place
         self.command_list: List[int] = command_list.copy()
         self.position: int = 0
         self.is_complete: bool = False
+        # set when run stops b/c it used up its instruction budget or time
+        self.is_paused: bool = False
+        self.num_instructions: int = 0
+        # hash of every write made so far, only kept up to date when detecting loops
+        self.detect_loops: bool = detect_loops
+        self._memory_fingerprint: int = 0
 
     def execute_add(self):
         num1: int = self.get_position_value(self.position + 1)
         num2: int = self.get_position_value(self.position + 2)
         dest: int = self.command_list[self.position + 3]
-        self.command_list[dest] = num1 + num2
+        self._write(dest, num1 + num2)
         self.position += 4
 
     def execute_multiply(self):
         num1: int = self.get_position_value(self.position + 1)
         num2: int = self.get_position_value(self.position + 2)
         dest: int = self.command_list[self.position + 3]
-        self.command_list[dest] = num1 * num2
+        self._write(dest, num1 * num2)
         self.position += 4
 
+    def _write(self, index: int, value: int) -> None:
+        if self.detect_loops:
+            old_value = self.command_list[index]
+            # xor in and out hashes of (index, value) so the order of writes doesn't matter
+            self._memory_fingerprint ^= hash((index, old_value)) ^ hash((index, value))
+        self.command_list[index] = value
+
+    def _check_for_loop(self, loop_detector: LoopDetector) -> None:
+        """Raise InfiniteLoopError if the program is back in a state it was already in
+
+        Memory is compared by a fingerprint of the writes, so only writes made through
+        _write count. A new LoopDetector is used for each call to run.
+
+        >>> icp = IntCodeProgram([1, 0, 0, 0, 99], detect_loops=True)
+        >>> loop_detector = LoopDetector()
+        >>> icp._check_for_loop(loop_detector)
+        >>> icp._write(3, 7)
+        >>> icp._check_for_loop(loop_detector)
+        >>> icp._write(3, 0)
+        >>> icp._check_for_loop(loop_detector)  # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+        ...
+        InfiniteLoopError: Program loops back to position 0
+        """
+        if loop_detector.check((self.position, self._memory_fingerprint)):
+            raise InfiniteLoopError(f"Program loops back to position {self.position}")
+
     def set_exit(self):
         self.is_complete = True
 
-    def run(self) -> None:
-        """
+    def run(
+        self,
+        max_instructions: Optional[int] = None,
+        timeout: Optional[float] = None,
+        check_every: int = 1000,
+    ) -> None:
+        """Run until the exit, an error, or the instruction budget or timeout runs out
+
+        If the budget or timeout runs out the program is left paused and calling run
+        again carries on from where it stopped. The clock is only checked every
+        `check_every` instructions.
+
         >>> icp = IntCodeProgram([1, 1, 1, 4, 99, 5, 6, 0, 99])
         >>> icp.run()
         >>> print(icp.command_list == [30, 1, 1, 4, 2, 5, 6, 0, 99])
         True
 
+        >>> icp = IntCodeProgram([1, 9, 10, 9, 1, 11, 12, 11, 99, 0, 1, 0, 2])
+        >>> icp.run(max_instructions=1)
+        >>> icp.is_paused, icp.is_complete, icp.command_list[9]
+        (True, False, 1)
+        >>> icp.run(max_instructions=5)
+        >>> icp.is_paused, icp.is_complete, icp.num_instructions
+        (False, True, 3)
+
+        >>> icp = IntCodeProgram([1, 0, 0, 0, 99])
+        >>> icp.run(timeout=0)
+        >>> icp.is_paused, icp.num_instructions
+        (True, 0)
+
+        :param max_instructions: Optional[int], most instructions to run in this call
+        :param timeout: Optional[float], seconds this call may run for
+        :param check_every: int, instructions between checks of the budget and clock
         :return:
         """
-        while not self.is_complete:
-            self.run_one_command()
+        self.is_paused = False
+        deadline: Optional[float] = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        executed: int = 0
+        loop_detector = LoopDetector()
+        try:
+            while not self.is_complete:
+                batch_size: int = check_every
+                if max_instructions is not None:
+                    batch_size = min(batch_size, max_instructions - executed)
+                if batch_size <= 0 or (
+                    deadline is not None and time.monotonic() >= deadline
+                ):
+                    self.is_paused = True
+                    break
+                for _ in range(batch_size):
+                    if self.detect_loops:
+                        self._check_for_loop(loop_detector)
+                    self.run_one_command()
+                    executed += 1
+                    if self.is_complete:
+                        break
+        finally:
+            self.num_instructions += executed
 
     def get_current_command_function(self):
         try:
@@ -92,6 +215,22 @@ class IntCodeProgram:
 
         return getattr(self, command_name)
 
+    def fork(self) -> "IntCodeProgram":
+        """Copy the program in its current state, the copy can run without affecting this one
+
+        Keeping a fork around without running it works as a snapshot.
+
+        >>> icp = IntCodeProgram([1, 0, 0, 0, 1, 0, 0, 0, 99])
+        >>> icp.run_one_command()
+        >>> snapshot = icp.fork()
+        >>> icp.run()
+        >>> icp.command_list[0], snapshot.command_list[0], snapshot.position
+        (4, 2, 4)
+        """
+        forked = copy.copy(self)
+        forked.command_list = self.command_list.copy()
+        return forked
+
     def get_position_value(self, pos: int) -> int:
         index: int = self.command_list[pos]
         return self.command_list[index]
@@ -147,6 +286,7 @@ def build_arg_parser() -> ArgumentParser:
     arg_parser.add_argument(
         "-t", "--test", help="Run the tests for this solution", action="store_true"
     )
+    add_profiling_args(arg_parser)
     return arg_parser
 
 
@@ -162,17 +302,22 @@ def run(arg_parser: ArgumentParser) -> None:
             return
 
     if not args.test or args.run:
+        timings = StageTimings.from_args(Path(__file__).stem, args)
         print("Parsing input...")
-        parsed_input = parse_input(Path(args.input))
+        with timings.stage("parse"):
+            parsed_input = parse_input(Path(args.input))
         if not parsed_input:
             print("Could not parse input.")
             return
         print("Computing answer for part 1...")
-        answer_1 = main_1(parsed_input)
+        with timings.stage("part_1"):
+            answer_1 = main_1(parsed_input)
         print(f"Answer for part 1: {answer_1}")
         print("Computing answer for part 2...")
-        answer_2 = main_2(parsed_input)
+        with timings.stage("part_2"):
+            answer_2 = main_2(parsed_input)
         print(f"Answer for part 2: {answer_2}")
+        timings.report()
 
 
 if __name__ == "__main__":
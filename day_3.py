@@ -1,29 +1,125 @@
 """Solution for https://adventofcode.com/2019/day/3/"""
 from argparse import ArgumentParser
+from array import array
 import doctest
+import heapq
+from itertools import repeat
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from profiling import StageTimings, add_profiling_args
 
 DEFAULT_INPUT_FILE_PATH = "input_3.txt"
 
 
 def main_1(parsed_input) -> int:
+    """
+    >>> main_1([["R8", "U5", "L5", "D3"], ["U7", "R6", "D4", "L4"]])
+    6
+    >>> main_1([["R75","D30","R83","U83","L12","D49","R71","U7","L72"],
+    ...         ["U62","R66","U55","R34","D71","R55","D58","R83"]])
+    159
+    """
     wires = [Wire(wire_input) for wire_input in parsed_input]
-    cb = CircuitBox(*wires)
-    intersections = cb.get_intersections()
-    return min([manhattan_distance((0, 0), coord) for coord in intersections])
+    return _best_over_wire_pairs(
+        wires,
+        segment_bound=_distance_bound,
+        crossing_cost=lambda point, seg_1, seg_2: manhattan_distance((0, 0), point),
+        pair_bound=max,
+    )
 
 
 def main_2(parsed_input) -> int:
+    """
+    >>> main_2([["R8", "U5", "L5", "D3"], ["U7", "R6", "D4", "L4"]])
+    30
+    >>> main_2([["R98","U47","R26","D63","R33","U87","L62","D20","R33","U53","R51"],
+    ...         ["U98","R91","D20","R16","D67","R40","U7","R15","U6","R7"]])
+    410
+    """
     wires = [Wire(wire_input) for wire_input in parsed_input]
-    cb = CircuitBox(*wires)
-    intersections = cb.get_intersections()
-    total_steps_to_interections: List[int] = []
-    for intsxn in intersections:
-        total_steps_to_interections.append(
-            sum([w.how_many_steps_to(intsxn) for w in cb.wires])
-        )
-    return min(total_steps_to_interections)
+    return _best_over_wire_pairs(
+        wires,
+        segment_bound=lambda seg: seg.start_steps + 1,
+        crossing_cost=lambda point, seg_1, seg_2: seg_1.steps_to(point)
+        + seg_2.steps_to(point),
+        pair_bound=lambda bound_1, bound_2: bound_1 + bound_2,
+    )
+
+
+def _distance_bound(segment: "Segment") -> int:
+    """Smallest Manhattan distance from the origin to any point on the segment"""
+    closest_x = min(max(0, segment.min_x), segment.max_x)
+    closest_y = min(max(0, segment.min_y), segment.max_y)
+    return abs(closest_x) + abs(closest_y)
+
+
+def _best_over_wire_pairs(wires: List["Wire"], **search_functions) -> Optional[int]:
+    best: Optional[int] = None
+    for i, wire_1 in enumerate(wires):
+        for wire_2 in wires[i + 1 :]:
+            best = find_best_crossing(wire_1, wire_2, best=best, **search_functions)
+    return best
+
+
+def find_best_crossing(
+    wire_1: "Wire",
+    wire_2: "Wire",
+    segment_bound: Callable[["Segment"], int],
+    crossing_cost: Callable[[Tuple[int, int], "Segment", "Segment"], int],
+    pair_bound: Callable[[int, int], int],
+    best: Optional[int] = None,
+) -> Optional[int]:
+    """Best-first search for the cheapest crossing of two wires, other than the origin
+
+    Segments of both wires are visited in order of their lower bound and each one is
+    only checked against the already visited segments of the other wire, so every pair
+    is checked once. The search stops as soon as no remaining pair can beat `best`.
+
+    >>> w1 = Wire(["R8", "U5", "L5", "D3"])
+    >>> w2 = Wire(["U7", "R6", "D4", "L4"])
+    >>> find_best_crossing(w1, w2, _distance_bound,
+    ...                    lambda point, s1, s2: manhattan_distance((0, 0), point), max)
+    6
+    >>> find_best_crossing(w1, w2, _distance_bound,
+    ...                    lambda point, s1, s2: manhattan_distance((0, 0), point), max, best=4)
+    4
+    >>> print(find_best_crossing(Wire(["U2"]), Wire(["R2"]), _distance_bound,
+    ...                          lambda point, s1, s2: 0, max))
+    None
+
+    :param segment_bound: lower bound on the cost of any crossing on a segment
+    :param crossing_cost: actual cost of a crossing at a point of two segments
+    :param pair_bound: combines the bounds of two segments into a bound for the pair,
+                       must not be smaller than either bound
+    :param best: Optional[int], best cost found so far, only better crossings are searched for
+    :return: Optional[int], cost of the best crossing or `best` if none beat it
+    """
+    queue: List[Tuple[int, int, int, Segment]] = []
+    for wire_index, wire in enumerate((wire_1, wire_2)):
+        for segment in wire.segments:
+            queue.append((segment_bound(segment), id(segment), wire_index, segment))
+    if not queue:
+        return best
+    heapq.heapify(queue)
+    lowest_bound: int = queue[0][0]
+    visited: Tuple[SegmentGrid, SegmentGrid] = (SegmentGrid(), SegmentGrid())
+    while queue:
+        bound, _, wire_index, segment = heapq.heappop(queue)
+        # every unchecked pair includes a segment with at least this bound
+        if best is not None and pair_bound(bound, lowest_bound) >= best:
+            break
+        for other in visited[1 - wire_index].candidates(segment):
+            if best is not None and pair_bound(bound, segment_bound(other)) >= best:
+                continue
+            for point in other.crossings_with(segment):
+                if point == (0, 0):
+                    continue
+                cost = crossing_cost(point, other, segment)
+                if best is None or cost < best:
+                    best = cost
+        visited[wire_index].add(segment)
+    return best
 
 
 def parse_input(input_path: Path) -> List[List[str]]:
@@ -41,14 +137,6 @@ def parse_input(input_path: Path) -> List[List[str]]:
 
 
 class Wire:
-
-    direction_to_function_map = {
-        "U": "add_one_up",
-        "D": "add_one_down",
-        "L": "add_one_left",
-        "R": "add_one_right",
-    }
-
     def __init__(self, path_list: List[str]):
         """
         >>> w = Wire(["U1", "R1", "D1", "L1"])
@@ -56,47 +144,167 @@ class Wire:
 
         >>> w = Wire(["U1", "R2", "D1", "L2"])
         >>> assert w.coords_list == [(0, 0), (0, 1), (1, 1), (2, 1), (2, 0), (1, 0), (0, 0)]
+        >>> w.add_length("U2")
+        >>> w.num_steps, w.last_position, w.coords_list[-2:]
+        (8, (0, 2), [(0, 1), (0, 2)])
         """
-        self.coords_list: List[Tuple[int, int]] = [(0, 0)]
+        self.path_list: List[str] = []
+        self.segments: List[Segment] = []
+        self.last_position: Tuple[int, int] = (0, 0)
+        self.num_steps: int = 0
+        # every point is only built when something asks for coords_list
+        self._coords_list: Optional[List[Tuple[int, int]]] = None
         for path_str in path_list:
             self.add_length(path_str)
 
     @property
-    def last_position(self) -> Tuple[int, int]:
-        return self.coords_list[-1]
+    def coords_list(self) -> List[Tuple[int, int]]:
+        """Every point along the wire in order, starting from the origin"""
+        if self._coords_list is None:
+            self._coords_list = list(zip(*path_coords(self.path_list)))
+        return self._coords_list
 
     def add_length(self, length_str: str) -> None:
         direction: str = length_str[0]
-        assert direction in self.direction_to_function_map
+        assert direction in Segment.direction_to_delta_map
         distance: int = int(length_str[1:])
+        if distance:
+            segment = Segment(
+                self, self.last_position, direction, distance, self.num_steps
+            )
+            self.segments.append(segment)
+            self.last_position = segment.end
+        if self._coords_list is not None:
+            xs, ys = path_coords([length_str], start=self._coords_list[-1])
+            self._coords_list.extend(zip(xs[1:], ys[1:]))
+        self.path_list.append(length_str)
+        self.num_steps += distance
 
-        function_name = self.direction_to_function_map[direction]
-        direction_function = getattr(self, function_name)
-        for _ in range(distance):
-            direction_function()
+    def how_many_steps_to(self, coord: Tuple[int, int]) -> int:
+        return self.coords_list.index(coord)
 
-    def add_one_up(self) -> None:
-        last_pos = self.last_position
-        new_pos: Tuple[int, int] = (last_pos[0], last_pos[1] + 1)
-        self.coords_list.append(new_pos)
 
-    def add_one_down(self) -> None:
-        last_pos = self.last_position
-        new_pos: Tuple[int, int] = (last_pos[0], last_pos[1] - 1)
-        self.coords_list.append(new_pos)
+def path_coords(
+    path_list: List[str], start: Tuple[int, int] = (0, 0)
+) -> Tuple[array, array]:
+    """x and y of every point along a path, including the start, as int32 arrays
 
-    def add_one_left(self) -> None:
-        last_pos = self.last_position
-        new_pos: Tuple[int, int] = (last_pos[0] - 1, last_pos[1])
-        self.coords_list.append(new_pos)
+    Each move is added as a whole range rather than one step at a time.
 
-    def add_one_right(self) -> None:
-        last_pos = self.last_position
-        new_pos: Tuple[int, int] = (last_pos[0] + 1, last_pos[1])
-        self.coords_list.append(new_pos)
+    >>> xs, ys = path_coords(["R3", "U1", "L2", "D0"], start=(1, 1))
+    >>> xs.typecode, list(zip(xs, ys))
+    ('i', [(1, 1), (2, 1), (3, 1), (4, 1), (4, 2), (3, 2), (2, 2)])
+    """
+    x, y = start
+    xs = array("i", [x])
+    ys = array("i", [y])
+    for path_str in path_list:
+        d_x, d_y = Segment.direction_to_delta_map[path_str[0]]
+        distance: int = int(path_str[1:])
+        if d_x:
+            xs.extend(range(x + d_x, x + d_x * (distance + 1), d_x))
+            ys.extend(repeat(y, distance))
+            x += d_x * distance
+        else:
+            xs.extend(repeat(x, distance))
+            ys.extend(range(y + d_y, y + d_y * (distance + 1), d_y))
+            y += d_y * distance
+    return xs, ys
 
-    def how_many_steps_to(self, coord: Tuple[int, int]) -> int:
-        return self.coords_list.index(coord)
+
+class Segment:
+    """A single straight run of a wire
+
+    The segment covers the points after `start` up to and including `end`, so consecutive
+    segments of a wire never share a point. The first segment of a wire also covers its start.
+
+    >>> seg = Segment(None, (1, 1), "L", 3, 5)
+    >>> seg.end
+    (-2, 1)
+    >>> seg.steps_to((0, 1))
+    6
+    """
+
+    direction_to_delta_map = {"U": (0, 1), "D": (0, -1), "L": (-1, 0), "R": (1, 0)}
+
+    def __init__(
+        self,
+        wire: "Wire",
+        start: Tuple[int, int],
+        direction: str,
+        distance: int,
+        start_steps: int,
+    ):
+        self.wire = wire
+        self.start: Tuple[int, int] = start
+        d_x, d_y = self.direction_to_delta_map[direction]
+        self.end: Tuple[int, int] = (
+            start[0] + d_x * distance,
+            start[1] + d_y * distance,
+        )
+        self.start_steps: int = start_steps
+        self.covers_start: bool = start_steps == 0
+        self.min_x: int = min(self.start[0], self.end[0])
+        self.max_x: int = max(self.start[0], self.end[0])
+        self.min_y: int = min(self.start[1], self.end[1])
+        self.max_y: int = max(self.start[1], self.end[1])
+
+    def steps_to(self, coord: Tuple[int, int]) -> int:
+        """Steps along the wire to reach a point on this segment"""
+        return self.start_steps + manhattan_distance(self.start, coord)
+
+    def crossings_with(self, other: "Segment") -> Iterator[Tuple[int, int]]:
+        """Yield every point shared by this segment and another one
+
+        >>> seg_1 = Segment(None, (0, 2), "R", 4, 2)
+        >>> seg_2 = Segment(None, (2, 0), "U", 4, 2)
+        >>> list(seg_1.crossings_with(seg_2))
+        [(2, 2)]
+        >>> seg_3 = Segment(None, (1, 2), "R", 2, 3)
+        >>> list(seg_1.crossings_with(seg_3))
+        [(2, 2), (3, 2)]
+        >>> list(seg_2.crossings_with(Segment(None, (2, 4), "R", 1, 6)))
+        []
+        """
+        # both segments are axis aligned so the overlap is a point, a line or nothing
+        for x in range(max(self.min_x, other.min_x), min(self.max_x, other.max_x) + 1):
+            for y in range(
+                max(self.min_y, other.min_y), min(self.max_y, other.max_y) + 1
+            ):
+                if self.covers_start or (x, y) != self.start:
+                    if other.covers_start or (x, y) != other.start:
+                        yield x, y
+
+
+class SegmentGrid:
+    """Spatial index of segments bucketed into square cells of `bucket_size`
+
+    Memory grows with the total length of the wires, not with the number of wire pairs.
+    """
+
+    def __init__(self, bucket_size: int = 64):
+        self.bucket_size: int = bucket_size
+        # format {(bucket-x, bucket-y): [Segment1, Segment2]}
+        self.buckets: Dict[Tuple[int, int], List[Segment]] = {}
+
+    def _bucket_keys(self, segment: Segment) -> Iterator[Tuple[int, int]]:
+        size = self.bucket_size
+        for b_x in range(segment.min_x // size, segment.max_x // size + 1):
+            for b_y in range(segment.min_y // size, segment.max_y // size + 1):
+                yield b_x, b_y
+
+    def add(self, segment: Segment) -> None:
+        for key in self._bucket_keys(segment):
+            self.buckets.setdefault(key, []).append(segment)
+
+    def candidates(self, segment: Segment) -> Iterator[Segment]:
+        """Yield each indexed segment sharing a bucket with `segment` exactly once"""
+        seen = set()
+        for key in self._bucket_keys(segment):
+            for other in self.buckets.get(key, []):
+                if id(other) not in seen:
+                    seen.add(id(other))
+                    yield other
 
 
 class CircuitBox:
@@ -111,31 +319,167 @@ class CircuitBox:
         :param args:
         """
         self.wires: List[Wire] = args
-        # format {x-val: {y-val: [Wire1, Wire2]}}
-        self.coord_grid: Dict[int, Dict[int, list]] = {0: {0: []}}
+        # format {x-val: {y-val: {id(Wire1), id(Wire2)}}}, only built by get_intersections
+        self.coord_grid: Optional[Dict[int, Dict[int, Set[int]]]] = None
         self._intersections: List[Tuple[int, int]] = []
+        # live index of every segment in the box, only built once the best answers are
+        # asked for or a wire is extended, then kept up to date by extend_wire
+        self.segment_grid: Optional[SegmentGrid] = None
+        self._best_distance: Optional[int] = None
+        self._best_steps: Optional[int] = None
         for wire in args:
             assert isinstance(wire, Wire)
             self.add_wire(wire)
 
     def add_wire(self, wire: Wire) -> None:
-        for x, y in wire.coords_list:
-            if x not in self.coord_grid:
-                self.coord_grid[x] = {}
-            if y not in self.coord_grid[x]:
-                self.coord_grid[x][y] = []
-            this_coord: List[Wire] = self.coord_grid[x][y]
-            # if crossing another wire, add to _intersections
-            if any((w is not wire for w in this_coord)):
-                self._intersections.append((x, y))
-            this_coord.append(wire)
+        if self.coord_grid is not None:
+            self._add_coords(wire, wire.coords_list)
+        if self.segment_grid is not None:
+            for segment in wire.segments:
+                self._add_segment(segment)
+
+    @property
+    def best_distance(self) -> Optional[int]:
+        """Smallest distance from the origin to a crossing of two wires"""
+        self._track_best()
+        return self._best_distance
+
+    @property
+    def best_steps(self) -> Optional[int]:
+        """Fewest combined steps two wires take to a crossing"""
+        self._track_best()
+        return self._best_steps
+
+    def _track_best(self) -> None:
+        """Index every segment so far, checking all pairs once, if not done already"""
+        if self.segment_grid is None:
+            self.segment_grid = SegmentGrid()
+            for wire in self.wires:
+                for segment in wire.segments:
+                    self._add_segment(segment)
+
+    def extend_wire(self, wire: Wire, length_str: str) -> None:
+        """Append a single move to a wire already in the box
+
+        The first call indexes every segment already in the box. After that only the new
+        segment is checked against the box, so best_distance and best_steps stay current
+        without rebuilding.
+
+        >>> w1 = Wire(["R8", "U5", "L5"])
+        >>> w2 = Wire(["U7", "R6", "D4"])
+        >>> cb = CircuitBox(w1, w2)
+        >>> cb.best_distance, cb.best_steps
+        (11, 30)
+        >>> cb.extend_wire(w1, "D3")
+        >>> cb.extend_wire(w2, "L4")
+        >>> cb.best_distance, cb.best_steps
+        (6, 30)
+        >>> assert cb.get_intersections() == [(6, 5), (3, 3)]
+
+        :param wire: Wire, must already be in the box
+        :param length_str: str, move such as "U7"
+        """
+        assert any((w is wire for w in self.wires))
+        self._track_best()
+        num_segments: int = len(wire.segments)
+        if self.coord_grid is None:
+            wire.add_length(length_str)
+        else:
+            num_coords: int = len(wire.coords_list)
+            wire.add_length(length_str)
+            self._add_coords(wire, wire.coords_list[num_coords:])
+        for segment in wire.segments[num_segments:]:
+            self._add_segment(segment)
+
+    def _add_coords(self, wire: Wire, coords: List[Tuple[int, int]]) -> None:
+        wire_id: int = id(wire)
+        for x, y in coords:
+            column = self.coord_grid.setdefault(x, {})
+            if y not in column:
+                column[y] = {wire_id}
+                continue
+            wire_ids: Set[int] = column[y]
+            if wire_id not in wire_ids:
+                wire_ids.add(wire_id)
+                # crossed by a second wire for the first time
+                if len(wire_ids) == 2:
+                    self._intersections.append((x, y))
+
+    def _add_segment(self, segment: Segment) -> None:
+        """Index a segment and update the best answers with any crossings it makes"""
+        for other in self.segment_grid.candidates(segment):
+            if other.wire is segment.wire:
+                continue
+            for point in other.crossings_with(segment):
+                if point == (0, 0):
+                    continue
+                distance = manhattan_distance((0, 0), point)
+                if self._best_distance is None or distance < self._best_distance:
+                    self._best_distance = distance
+                steps = other.steps_to(point) + segment.steps_to(point)
+                if self._best_steps is None or steps < self._best_steps:
+                    self._best_steps = steps
+        self.segment_grid.add(segment)
 
     def get_intersections(self, include_origin: bool = False) -> List[Tuple[int, int]]:
+        """Every point crossed by at least two wires, in the order they were found
+
+        Builds every point of every wire the first time it is called, use
+        iter_intersections to stop early instead.
+        """
+        if self.coord_grid is None:
+            self.coord_grid = {}
+            for wire in self.wires:
+                self._add_coords(wire, wire.coords_list)
         intersections_copy = self._intersections.copy()
         if not include_origin:
             intersections_copy.remove((0, 0))
         return intersections_copy
 
+    def iter_intersections(
+        self, include_origin: bool = False, bucket_size: int = 64
+    ) -> Iterator[Tuple[Wire, Wire, Tuple[int, int], int, int]]:
+        """Stream (wire_a, wire_b, point, steps_a, steps_b) for every crossing of two wires
+
+        wire_a is always the wire that was added to the box first. Crossings are found
+        segment by segment, so callers can stop consuming as soon as they have an answer.
+        A wire that passes the same point twice yields that point once per visit.
+
+        >>> w1 = Wire(["R8", "U5", "L5", "D3"])
+        >>> w2 = Wire(["U7", "R6", "D4", "L4"])
+        >>> w3 = Wire(["L1", "U3", "R4"])
+        >>> cb = CircuitBox(w1, w2, w3)
+        >>> for w_a, w_b, point, steps_a, steps_b in cb.iter_intersections():
+        ...     print(cb.wires.index(w_a), cb.wires.index(w_b), point, steps_a, steps_b)
+        0 1 (6, 5) 15 15
+        0 1 (3, 3) 20 20
+        0 2 (3, 3) 20 8
+        1 2 (0, 3) 3 5
+        1 2 (2, 3) 21 7
+        1 2 (3, 3) 20 8
+        >>> len(list(cb.iter_intersections(include_origin=True)))
+        9
+
+        :param include_origin: bool, default False, whether to yield the shared starting point
+        :param bucket_size: int, width of the square cells used to index segments
+        :return: Iterator of tuples of two wires, the point where they cross and the steps
+                 each wire takes to get there
+        """
+        grid = SegmentGrid(bucket_size)
+        for wire in self.wires:
+            for segment in wire.segments:
+                for other in grid.candidates(segment):
+                    if other.wire is wire:
+                        continue
+                    for point in other.crossings_with(segment):
+                        steps_a = other.steps_to(point)
+                        steps_b = segment.steps_to(point)
+                        # both wires sitting at the start is not a real crossing
+                        if steps_a or steps_b or include_origin:
+                            yield other.wire, wire, point, steps_a, steps_b
+            for segment in wire.segments:
+                grid.add(segment)
+
 
 def manhattan_distance(coord_1, coord_2) -> int:
     """
@@ -158,6 +502,7 @@ def build_arg_parser() -> ArgumentParser:
     arg_parser.add_argument(
         "-t", "--test", help="Run the tests for this solution", action="store_true"
     )
+    add_profiling_args(arg_parser)
     return arg_parser
 
 
@@ -173,17 +518,22 @@ def run(arg_parser: ArgumentParser) -> None:
             return
 
     if not args.test or args.run:
+        timings = StageTimings.from_args(Path(__file__).stem, args)
         print("Parsing input...")
-        parsed_input = parse_input(Path(args.input))
+        with timings.stage("parse"):
+            parsed_input = parse_input(Path(args.input))
         if not parsed_input:
             print("Could not parse input.")
             return
         print("Computing answer for part 1...")
-        answer_1 = main_1(parsed_input)
+        with timings.stage("part_1"):
+            answer_1 = main_1(parsed_input)
         print(f"Answer for part 1: {answer_1}")
         print("Computing answer for part 2...")
-        answer_2 = main_2(parsed_input)
+        with timings.stage("part_2"):
+            answer_2 = main_2(parsed_input)
         print(f"Answer for part 2: {answer_2}")
+        timings.report()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,21 @@
 """Solution for https://adventofcode.com/2019/day/4"""
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 import doctest
-from typing import List, Optional, Tuple
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from profiling import StageTimings, add_profiling_args
 
 
 def main_1(start: int, end: int) -> int:
@@ -20,8 +34,233 @@ def main_2(start, end) -> int:
     return sum([_is_valid_2(num) for num in range(start, end + 1)])
 
 
-def _is_valid_1(number: int):
+class DigitRule:
+    """A password rule, checked by the scanner built by compile_rules
+
+    The scanner walks the digits of a number left to right as length-1 strings and
+    keeps one bool per rule saying whether the rule passes so far. A rule overrides any
+    of these methods, each returning the new bool:
+        initial(digits): before the first digit, digits is the whole number as a str
+        on_new_run(passing, previous, digit): when a run of `digit` starts, previous is
+            the digit of the run before it, "" for the first run
+        on_run_end(passing, run_length): when a run ends, including the last one
+
+    Set `can_fail_early` if a rule never passes again once it has failed, which lets
+    the scanner stop as soon as every rule set has failed. The rules in this module are
+    written straight into the scanner, any other rule is called through its methods.
+
+    >>> class NoZeros(DigitRule):
+    ...     can_fail_early = True
+    ...     def on_new_run(self, passing, previous, digit):
+    ...         return passing and digit != "0"
+    >>> is_valid = compile_rules([NoZeros()])
+    >>> is_valid(4321), is_valid(4301)
+    (True, False)
+    >>> both = compile_rules([NonDecreasing(), NoZeros()], [RunLengthEquals(2)])
+    >>> both(1122), both(1100), both(2211)
+    ((True, True), (False, True), (False, True))
+    """
+
+    can_fail_early: bool = False
+
+    def key(self) -> Hashable:
+        """Rules with the same key are only checked once per number"""
+        return id(self)
+
+    def initial(self, digits: str) -> bool:
+        return True
+
+    def on_new_run(self, passing: bool, previous: str, digit: str) -> bool:
+        return passing
+
+    def on_run_end(self, passing: bool, run_length: int) -> bool:
+        return passing
+
+
+class NonDecreasing(DigitRule):
+    can_fail_early = True
+
+    def key(self) -> Hashable:
+        return "non_decreasing"
+
+    def on_new_run(self, passing: bool, previous: str, digit: str) -> bool:
+        return passing and digit >= previous
+
+
+class RunLengthEquals(DigitRule):
+    """Some run of the same digit is exactly `length` long"""
+
+    def __init__(self, length: int):
+        self.length: int = _positive_int(length)
+
+    def key(self) -> Hashable:
+        return ("run_eq", self.length)
+
+    def initial(self, digits: str) -> bool:
+        return False
+
+    def on_run_end(self, passing: bool, run_length: int) -> bool:
+        return passing or run_length == self.length
+
+
+class RunLengthAtLeast(DigitRule):
+    """Some run of the same digit is at least `length` long"""
+
+    def __init__(self, length: int):
+        self.length: int = _positive_int(length)
+
+    def key(self) -> Hashable:
+        return ("run_ge", self.length)
+
+    def initial(self, digits: str) -> bool:
+        return False
+
+    def on_run_end(self, passing: bool, run_length: int) -> bool:
+        return passing or run_length >= self.length
+
+
+class NumDigits(DigitRule):
+    def __init__(self, num_digits: int):
+        self.num_digits: int = _positive_int(num_digits)
+
+    def key(self) -> Hashable:
+        return ("num_digits", self.num_digits)
+
+    def initial(self, digits: str) -> bool:
+        return len(digits) == self.num_digits
+
+
+def _positive_int(value: int) -> int:
+    """
+    >>> RunLengthEquals("2")  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    ValueError: Expected a positive int, got '2'
+    """
+    if not isinstance(value, int) or value < 1:
+        raise ValueError(f"Expected a positive int, got {value!r}")
+    return value
+
+
+def _rule_source(rule: DigitRule, index: int) -> Tuple[str, str, str]:
+    """Initial value, new run code and run end code for a rule in the scanner
+
+    In the code "{state}" stands for the rule's variable and a line that is only
+    "{fail}" fails the rule for good. Only the rules in this module are inlined, any
+    other rule is called as `_rules[index]`.
+    """
+    kind = type(rule)
+    if kind is NonDecreasing:
+        return "True", "if digit < previous:\n    {fail}\n", ""
+    if kind is RunLengthEquals:
+        return "False", "", f"if run_length == {rule.length}:\n    {{state}} = True\n"
+    if kind is RunLengthAtLeast:
+        return "False", "", f"if run_length >= {rule.length}:\n    {{state}} = True\n"
+    if kind is NumDigits:
+        return f"len(digits) == {rule.num_digits}", "", ""
+    call: str = f"_rules[{index}]"
+    fail_check: str = "if not {state}:\n    {fail}\n" if rule.can_fail_early else ""
+    on_new_run: str = ""
+    if kind.on_new_run is not DigitRule.on_new_run:
+        on_new_run = f"{{state}} = {call}.on_new_run({{state}}, previous, digit)\n"
+        on_new_run += fail_check
+    on_run_end: str = ""
+    if kind.on_run_end is not DigitRule.on_run_end:
+        on_run_end = f"{{state}} = {call}.on_run_end({{state}}, run_length)\n"
+        on_run_end += fail_check
+    return f"{call}.initial(digits)", on_new_run, on_run_end
+
+
+def compile_rules(*rule_sets: Sequence[DigitRule]) -> Callable[[int], Any]:
+    """Build a function checking a number against each rule set in one pass over its digits
+
+    Rules shared by several sets are only evaluated once. The function returns a bool
+    for a single rule set and a tuple of bools for several.
+
+    >>> is_valid = compile_rules([NonDecreasing(), RunLengthAtLeast(2)])
+    >>> is_valid(111111), is_valid(223450), is_valid(123789)
+    (True, False, False)
+    >>> is_valid = compile_rules([NonDecreasing(), RunLengthEquals(2)])
+    >>> is_valid(112233), is_valid(123444), is_valid(111122)
+    (True, False, True)
+    >>> both = compile_rules([NonDecreasing(), RunLengthAtLeast(2)],
+    ...                      [NonDecreasing(), RunLengthEquals(2), NumDigits(6)])
+    >>> both(123444), both(112233), both(1122), both(321)
+    ((True, False), (True, True), (True, False), (False, False))
+
+    :param rule_sets: each one a sequence of rules that must all pass
+    :return: function taking an int
     """
+    rules: Dict[Hashable, DigitRule] = {}
+    for rule_set in rule_sets:
+        for rule in rule_set:
+            rules.setdefault(rule.key(), rule)
+    names: Dict[Hashable, str] = {key: f"rule_{i}" for i, key in enumerate(rules)}
+    sources: Dict[Hashable, Tuple[str, str, str]] = {
+        key: _rule_source(rule, i) for i, (key, rule) in enumerate(rules.items())
+    }
+
+    def all_of(rule_set: Sequence[DigitRule]) -> str:
+        return " and ".join(names[rule.key()] for rule in rule_set) or "True"
+
+    if len(rule_sets) == 1:
+        all_failed: str = "False"
+        results: str = all_of(rule_sets[0])
+    else:
+        all_failed = "(" + "False, " * len(rule_sets) + ")"
+        results = "(" + "".join(f"{all_of(rs)}, " for rs in rule_sets) + ")"
+    # a rule set can only be given up on early if it has a rule that can fail early
+    early_rule_sets: List[Sequence[DigitRule]] = [
+        [rule for rule in rule_set if rule.can_fail_early] for rule_set in rule_sets
+    ]
+    stop_check: Optional[str] = None
+    if all(early_rule_sets):
+        alive_checks = {f"({all_of(rs)})": None for rs in early_rule_sets}
+        stop_check = " or ".join(alive_checks)
+
+    def expand(code: str, key: Hashable, indent: str) -> List[str]:
+        lines: List[str] = []
+        for line in code.replace("{state}", names[key]).splitlines():
+            if line.strip() == "{fail}":
+                line_indent = indent + line[: line.index("{")]
+                lines.append(f"{line_indent}{names[key]} = False")
+                if stop_check:
+                    lines.append(f"{line_indent}if not ({stop_check}):")
+                    lines.append(f"{line_indent}    return {all_failed}")
+            else:
+                lines.append(indent + line)
+        return lines
+
+    source: List[str] = ["def scanner(number):", "    digits = str(number)"]
+    source += ['    previous = ""', "    run_length = 0"]
+    source += [f"    {names[key]} = {sources[key][0]}" for key in rules]
+    source += ["    for digit in digits:", "        if digit == previous:"]
+    source += ["            run_length += 1", "            continue"]
+    run_end_lines: List[str] = []
+    for key in rules:
+        run_end_lines += expand(sources[key][2], key, " " * 12)
+    if run_end_lines:
+        source += ["        if run_length:"] + run_end_lines
+    for key in rules:
+        source += expand(sources[key][1], key, " " * 8)
+    source += ["        previous = digit", "        run_length = 1"]
+    # the last run has no following digit to end it
+    if run_end_lines:
+        source += ["    if run_length:"] + [line[4:] for line in run_end_lines]
+    source += [f"    return {results}"]
+
+    namespace: Dict[str, Any] = {"_rules": list(rules.values())}
+    exec("\n".join(source), namespace)
+    scanner = namespace["scanner"]
+    scanner.source = "\n".join(source)
+    return scanner
+
+
+PART_1_RULES: List[DigitRule] = [NonDecreasing(), RunLengthAtLeast(2)]
+PART_2_RULES: List[DigitRule] = [NonDecreasing(), RunLengthEquals(2)]
+
+_is_valid_1 = compile_rules(PART_1_RULES)
+_is_valid_1.__doc__ = """
     >>> _is_valid_1(111111)
     True
     >>> _is_valid_1(223450)
@@ -32,20 +271,9 @@ def _is_valid_1(number: int):
     :param number: number to check
     :return: bool, True if number passes the checks
     """
-    chunks = _chunkify(str(number))
-    has_double: bool = False
-    previous_int: Optional[int] = None
-    for char, count in chunks:
-        if count >= 2:
-            has_double = True
-        if previous_int and previous_int > int(char):
-            return False
-        previous_int = int(char)
-    return has_double
-
-
-def _is_valid_2(number: int):
-    """
+
+_is_valid_2 = compile_rules(PART_2_RULES)
+_is_valid_2.__doc__ = """
     >>> _is_valid_2(112233)
     True
     >>> _is_valid_2(123444)
@@ -56,55 +284,149 @@ def _is_valid_2(number: int):
     :param number: number to check
     :return: bool, True if number passes the checks
     """
-    chunks = _chunkify(str(number))
-    has_double: bool = False
-    previous_int: Optional[int] = None
-    for char, count in chunks:
-        if count == 2:
-            has_double = True
-        if previous_int and previous_int > int(char):
-            return False
-        previous_int = int(char)
-    return has_double
-
-
-def _chunkify(input_str: str):
-    """Return a list of tuples where each tuple is a single character and an integer
-    indicating how many of that character occur in a row.
-
-    >>> _chunkify("111")
-    [('1', 3)]
-    >>> _chunkify("1122")
-    [('1', 2), ('2', 2)]
-    >>> _chunkify("1234")
-    [('1', 1), ('2', 1), ('3', 1), ('4', 1)]
-    >>> _chunkify("121")
-    [('1', 1), ('2', 1), ('1', 1)]
-
-    :param input_str: string to turn into chunks
-    :return: List of tuples where each tuple is a length-1 string and an integer
+
+# doctest only looks for docstrings on functions defined in this module
+__test__ = {"_is_valid_1": _is_valid_1, "_is_valid_2": _is_valid_2}
+
+
+def generate_valid(
+    start: int, end: int, rules: Sequence[DigitRule] = PART_2_RULES
+) -> Iterator[int]:
+    """Yield the numbers in [start, end] that pass the rules, in ascending order
+
+    Only non-decreasing numbers are built, digit by digit, and any prefix whose smallest
+    or largest completion falls outside the range is skipped, so the work depends on the
+    number of non-decreasing numbers in range rather than the width of the range.
+
+    >>> list(generate_valid(111111, 111133))
+    [111122, 111133]
+    >>> list(generate_valid(90, 123, PART_1_RULES))
+    [99, 111, 112, 113, 114, 115, 116, 117, 118, 119, 122]
+    >>> found = list(generate_valid(372304, 847060))
+    >>> found == [num for num in range(372304, 847061) if _is_valid_2(num)]
+    True
+
+    :param start: beginning of range
+    :param end: end of range, inclusive
+    :param rules: rules that must all pass, must include NonDecreasing
+    :return: Iterator of valid numbers
+    """
+    assert any((isinstance(rule, NonDecreasing) for rule in rules))
+    is_valid = compile_rules(rules)
+    start = max(start, 0)
+    for num_digits in range(len(str(start)), len(str(end)) + 1):
+        lowest_digit: int = 1 if num_digits > 1 else 0
+        for number in _non_decreasing_numbers("", num_digits, lowest_digit, start, end):
+            if is_valid(number):
+                yield number
+
+
+def _non_decreasing_numbers(
+    prefix: str, remaining: int, lowest_digit: int, start: int, end: int
+) -> Iterator[int]:
+    """Yield the numbers in [start, end] made of prefix plus `remaining` non-decreasing digits
+
+    >>> list(_non_decreasing_numbers("1", 2, 1, 120, 135))
+    [122, 123, 124, 125, 126, 127, 128, 129, 133, 134, 135]
     """
-    chunks: List[Tuple[str, int]] = []
-    previous_char: str = input_str[0]
-    count: int = 1
-    for i in range(1, len(input_str)):
-        if input_str[i] == previous_char:
-            count += 1
+    if not remaining:
+        yield int(prefix)
+        return
+    for digit in range(lowest_digit, 10):
+        candidate: str = prefix + str(digit)
+        if int(candidate + "9" * (remaining - 1)) < start:
             continue
-        chunks.append((previous_char, count))
-        previous_char = input_str[i]
-        count = 1
-    chunks.append((previous_char, count))
-    return chunks
+        # later digits only make the smallest completion bigger
+        if int(candidate + str(digit) * (remaining - 1)) > end:
+            return
+        yield from _non_decreasing_numbers(candidate, remaining - 1, digit, start, end)
+
+
+def count_valid(
+    start: int,
+    end: int,
+    rule_sets: Sequence[Sequence[DigitRule]] = (PART_1_RULES, PART_2_RULES),
+    workers: int = 1,
+) -> List[int]:
+    """Count the numbers in [start, end] that pass each rule set
+
+    Every rule set is checked in the same pass over the digits of a number. With more
+    than 1 worker the range is split into balanced chunks counted in a process pool.
+
+    >>> count_valid(372304, 847060, workers=2)
+    [475, 297]
+    >>> count_valid(111111, 111133, rule_sets=[PART_2_RULES])
+    [2]
+
+    :param start: beginning of range
+    :param end: end of range, inclusive
+    :param rule_sets: each one a sequence of rules that must all pass
+    :param workers: int, number of processes to count with
+    :return: List[int], number of valid numbers for each rule set
+    """
+    if workers <= 1:
+        return _count_range(start, end, rule_sets)
+    ranges = _split_range(start, end, workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partial_counts = executor.map(
+            _count_range,
+            [r_start for r_start, _ in ranges],
+            [r_end for _, r_end in ranges],
+            [rule_sets] * len(ranges),
+        )
+        return [sum(counts) for counts in zip(*partial_counts)]
+
+
+def _count_range(
+    start: int, end: int, rule_sets: Sequence[Sequence[DigitRule]]
+) -> List[int]:
+    # compiled here b/c the scanner itself cannot be sent to another process
+    scanner = compile_rules(*rule_sets)
+    if len(rule_sets) == 1:
+        return [sum(map(scanner, range(start, end + 1)))]
+    counts: List[int] = [0] * len(rule_sets)
+    for results in map(scanner, range(start, end + 1)):
+        for i, result in enumerate(results):
+            if result:
+                counts[i] += 1
+    return counts
+
+
+def _split_range(start: int, end: int, num_parts: int) -> List[Tuple[int, int]]:
+    """Split [start, end] into at most num_parts inclusive ranges whose sizes differ by at most 1
+
+    >>> _split_range(0, 9, 3)
+    [(0, 3), (4, 6), (7, 9)]
+    >>> _split_range(5, 6, 4)
+    [(5, 5), (6, 6)]
+    """
+    size: int = end - start + 1
+    num_parts = max(1, min(num_parts, size))
+    base, extra = divmod(size, num_parts)
+    ranges: List[Tuple[int, int]] = []
+    r_start: int = start
+    for i in range(num_parts):
+        r_end = r_start + base + (1 if i < extra else 0) - 1
+        ranges.append((r_start, r_end))
+        r_start = r_end + 1
+    return ranges
 
 
 def build_arg_parser() -> ArgumentParser:
     arg_parser = ArgumentParser()
     arg_parser.add_argument("-s", "--start", type=int, help="Beginning of range")
     arg_parser.add_argument("-e", "--end", type=int, help="End of range")
+    arg_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Count both parts in one pass using this many processes",
+    )
     arg_parser.add_argument(
         "-t", "--test", help="Run the tests for this solution", action="store_true"
     )
+    add_profiling_args(arg_parser)
     return arg_parser
 
 
@@ -122,12 +444,26 @@ def run(arg_parser: ArgumentParser) -> None:
     if args.start or args.end:
         if not (args.start and args.end):
             raise ValueError("Must include START and END when running")
+        timings = StageTimings.from_args(Path(__file__).stem, args)
+        if args.workers > 1:
+            print(f"Computing answers with {args.workers} workers...")
+            with timings.stage("parts"):
+                answer_1, answer_2 = count_valid(
+                    args.start, args.end, workers=args.workers
+                )
+            print(f"Answer for part 1: {answer_1}")
+            print(f"Answer for part 2: {answer_2}")
+            timings.report()
+            return
         print("Computing answer for part 1...")
-        answer_1 = main_1(args.start, args.end)
+        with timings.stage("part_1"):
+            answer_1 = main_1(args.start, args.end)
         print(f"Answer for part 1: {answer_1}")
         print("Computing answer for part 2...")
-        answer_2 = main_2(args.start, args.end)
+        with timings.stage("part_2"):
+            answer_2 = main_2(args.start, args.end)
         print(f"Answer for part 2: {answer_2}")
+        timings.report()
 
 
 if __name__ == "__main__":
@@ -3,11 +3,30 @@ Based on Solution for Day 2
 """
 import abc
 from argparse import ArgumentParser
+from collections import deque
 import doctest
 from pathlib import Path
-from typing import Any, ClassVar, List
+import struct
+import time
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+)
+
+from profiling import StageTimings, add_profiling_args
 
 DEFAULT_INPUT_FILE_PATH = "input_5.txt"
+# most instructions fused into one ArithmeticChain, so decoding a chain stays cheap
+MAX_CHAIN_LENGTH = 16
 
 
 class UnknownCommandError(Exception):
@@ -18,18 +37,208 @@ class EndOfProgramError(Exception):
     pass
 
 
-def main_1(parsed_input) -> None:
+class InfiniteLoopError(Exception):
+    pass
+
+
+class DiagnosticError(Exception):
+    pass
+
+
+def main_1(parsed_input) -> int:
     """Expected answer for sample input: 7259358"""
-    InputCommand.set_default_input("1")
-    icp = IntCodeProgram(parsed_input)
-    icp.run()
+    return run_diagnostic(parsed_input, "1")
 
 
-def main_2(parsed_input) -> None:
+def main_2(parsed_input) -> int:
     """Expected answer for sample input: 11826654"""
-    InputCommand.set_default_input("5")
-    icp = IntCodeProgram(parsed_input)
+    return run_diagnostic(parsed_input, "5")
+
+
+def run_diagnostic(parsed_input: List[str], system_id: str) -> int:
+    """Run the diagnostic program for a system and return its diagnostic code
+
+    Every output before the diagnostic code is a test result that should be 0.
+
+    >>> run_diagnostic(["104", "0", "104", "0", "4", "0", "99"], "1")
+    104
+    >>> run_diagnostic(["104", "0", "104", "3", "104", "7", "99"], "1")
+    ... # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    DiagnosticError: Tests failed with outputs [3] before diagnostic code 7
+    >>> run_diagnostic(["99"], "1")  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    DiagnosticError: Program produced no output
+    """
+    InputCommand.set_default_input(system_id)
+    sink = CollectSink()
+    icp = IntCodeProgram(parsed_input, output_sink=sink)
     icp.run()
+    if not sink.values:
+        raise DiagnosticError("Program produced no output")
+    *test_results, diagnostic_code = sink.values
+    failed: List[int] = [result for result in test_results if result != 0]
+    if failed:
+        raise DiagnosticError(
+            f"Tests failed with outputs {failed} before diagnostic code "
+            f"{diagnostic_code}"
+        )
+    return diagnostic_code
+
+
+class OutputSink(abc.ABC):
+    """Where an IntCodeProgram sends the values from OutputCommand"""
+
+    @abc.abstractmethod
+    def write(self, value: int) -> None:
+        raise NotImplementedError("Cannot run 'write' on base OutputSink class")
+
+    def is_full(self) -> bool:
+        """A full sink makes the program wait before its next output"""
+        return False
+
+    def flush(self) -> None:
+        """Called when the program finishes running"""
+        pass
+
+
+class PrintSink(OutputSink):
+    def write(self, value: int) -> None:
+        print(value)
+
+
+class CollectSink(OutputSink):
+    """Keeps every value in memory, in a list by default or any container with append
+
+    >>> from array import array
+    >>> sink = CollectSink(array("q"))
+    >>> IntCodeProgram(["104", "7", "4", "0", "99"], output_sink=sink).run()
+    >>> sink.values
+    array('q', [7, 104])
+    """
+
+    def __init__(self, values: Any = None):
+        self.values = values if values is not None else []
+
+    def write(self, value: int) -> None:
+        self.values.append(value)
+
+
+class BufferedFileSink(OutputSink):
+    """Writes values to a text file one per line, `buffer_size` values at a time
+
+    >>> import io
+    >>> out_file = io.StringIO()
+    >>> sink = BufferedFileSink(out_file, buffer_size=2)
+    >>> icp = IntCodeProgram(["104", "1", "104", "2", "104", "3", "99"], output_sink=sink)
+    >>> icp._run_instruction()
+    >>> out_file.getvalue()
+    ''
+    >>> icp.run()
+    >>> out_file.getvalue()
+    '1\\n2\\n3\\n'
+
+    Values written before an error are still flushed
+
+    >>> out_file = io.StringIO()
+    >>> sink = BufferedFileSink(out_file)
+    >>> icp = IntCodeProgram(["104", "1", "104", "2", "55"], output_sink=sink)
+    >>> icp.run()  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    UnknownCommandError: No command for opcode '55'
+    >>> out_file.getvalue()
+    '1\\n2\\n'
+    >>> icp = IntCodeProgram(["104", "1", "104", "2", "55"], output_sink=sink)
+    >>> icp.run_fused()  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    UnknownCommandError: No command for opcode '55'
+    >>> out_file.getvalue()
+    '1\\n2\\n1\\n2\\n'
+    """
+
+    def __init__(self, out_file: TextIO, buffer_size: int = 4096):
+        self.out_file: TextIO = out_file
+        self.buffer_size: int = buffer_size
+        self.buffer: List[str] = []
+
+    def write(self, value: int) -> None:
+        self.buffer.append(str(value))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.out_file.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+        self.out_file.flush()
+
+
+class RingBuffer(OutputSink):
+    """Bounded first in, first out buffer from one program's output to another's input
+
+    >>> buffer = RingBuffer(2)
+    >>> program = ["104", "1", "104", "2", "104", "3", "99"]
+    >>> sender = IntCodeProgram(program, output_sink=buffer)
+    >>> sender.run()
+    >>> sender.is_waiting, list(buffer)
+    (True, [1, 2])
+    >>> receiver = IntCodeProgram(["3", "5", "4", "5", "99", "0"], input_source=buffer)
+    >>> receiver.run()
+    1
+    >>> sender.run()
+    >>> sender.is_complete, list(buffer)
+    (True, [2, 3])
+    """
+
+    def __init__(self, capacity: int):
+        self.values: List[int] = [0] * capacity
+        self.start: int = 0
+        self.count: int = 0
+
+    def write(self, value: int) -> None:
+        if self.is_full():
+            raise IndexError("Write to full RingBuffer")
+        self.values[(self.start + self.count) % len(self.values)] = value
+        self.count += 1
+
+    def read(self) -> int:
+        if self.is_empty():
+            raise IndexError("Read from empty RingBuffer")
+        value = self.values[self.start]
+        self.start = (self.start + 1) % len(self.values)
+        self.count -= 1
+        return value
+
+    def is_full(self) -> bool:
+        return self.count == len(self.values)
+
+    def is_empty(self) -> bool:
+        return self.count == 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[int]:
+        for i in range(self.count):
+            yield self.values[(self.start + i) % len(self.values)]
+
+
+class CallbackSink(OutputSink):
+    """
+    >>> sink = CallbackSink(lambda value: print(value * 2))
+    >>> IntCodeProgram(["104", "5", "99"], output_sink=sink).run()
+    10
+    """
+
+    def __init__(self, callback: Callable[[int], Any]):
+        self.callback: Callable[[int], Any] = callback
+
+    def write(self, value: int) -> None:
+        self.callback(value)
 
 
 class CommandParams:
@@ -57,6 +266,7 @@ class CommandParams:
 
 class IntCodeCommand(abc.ABC):
 
+    opcode: int = 0
     command_params: CommandParams = CommandParams([], [])
 
     @staticmethod
@@ -93,6 +303,7 @@ class IntCodeCommand(abc.ABC):
         Must return a Dict that maps index to updated value(s)
         The "position" key in the dict indicates that the programs position should be updated
         to a certain index
+        The "output" key sends a value to the program's output sink
         """
         raise NotImplementedError("Cannot run 'execute' on base IntCodeCommand class")
 
@@ -100,6 +311,7 @@ class IntCodeCommand(abc.ABC):
 class AddCommand(IntCodeCommand):
     """Add command takes 2 inputs and returns 1 output"""
 
+    opcode = 1
     command_params = CommandParams(input_indices=[0, 1], output_indices=[2])
 
     def execute(self, num1: int, num2: int, out_index: int) -> dict:
@@ -110,6 +322,7 @@ class AddCommand(IntCodeCommand):
 class MultiplyCommand(IntCodeCommand):
     """Add command takes 2 inputs and returns 1 output"""
 
+    opcode = 2
     command_params = CommandParams(input_indices=[0, 1], output_indices=[2])
 
     def execute(self, num1: int, num2: int, out_index: int) -> dict:
@@ -126,6 +339,7 @@ class InputCommand(IntCodeCommand):
     >>> assert icp.command_list[2] == "5"
     """
 
+    opcode = 3
     command_params = CommandParams(input_indices=[], output_indices=[0])
     default_input: Any = "1"
 
@@ -139,7 +353,8 @@ class InputCommand(IntCodeCommand):
 
 class OutputCommand(IntCodeCommand):
     """
-    Output command prints a value from 1 input
+    Output command sends a value from 1 input to the program's output sink, which
+    prints it by default
 
     >>> icp = IntCodeProgram(["104", "4"])
     >>> icp._run_instruction()
@@ -149,11 +364,11 @@ class OutputCommand(IntCodeCommand):
     7
     """
 
+    opcode = 4
     command_params = CommandParams(input_indices=[0], output_indices=[])
 
     def execute(self, int_to_output: int) -> dict:
-        print(int_to_output)
-        return {}
+        return {"output": int_to_output}
 
 
 class JumpIfTrueCommand(IntCodeCommand):
@@ -178,6 +393,7 @@ class JumpIfTrueCommand(IntCodeCommand):
     >>> assert icp.position == 4
     """
 
+    opcode = 5
     command_params = CommandParams(input_indices=[0, 1], output_indices=[])
 
     def execute(self, param_to_check: int, jump_to_ind: int) -> dict:
@@ -208,6 +424,7 @@ class JumpIfFalseCommand(IntCodeCommand):
     >>> assert icp.position == 3
     """
 
+    opcode = 6
     command_params = CommandParams(input_indices=[0, 1], output_indices=[])
 
     def execute(self, param_to_check: int, jump_to_ind: int) -> dict:
@@ -237,6 +454,7 @@ class LessThanCommand(IntCodeCommand):
     >>> assert icp.position == 4
     """
 
+    opcode = 7
     command_params = CommandParams(input_indices=[0, 1], output_indices=[2])
 
     def execute(self, num1: int, num2: int, out_index: int) -> dict:
@@ -268,6 +486,7 @@ class EqualsCommand(IntCodeCommand):
     >>> assert icp.position == 4
     """
 
+    opcode = 8
     command_params = CommandParams(input_indices=[0, 1], output_indices=[2])
 
     def execute(self, num1: int, num2: int, out_index: int) -> dict:
@@ -281,19 +500,90 @@ class EqualsCommand(IntCodeCommand):
 class ExitCommand(IntCodeCommand):
     """Exit command just quits everything"""
 
+    opcode = 99
+
     def execute(self, *args) -> dict:
         return {"exit": None}
 
 
+class LoopDetector:
+    """Brent's cycle detection over the states a program passes through
+
+    Only one state is kept, and it is swapped for the current one after 1, 2, 4, 8...
+    more steps, so memory stays constant however long the program runs. A program that
+    repeats a state is caught within about twice the steps it takes to get back to it.
+
+    >>> detector = LoopDetector()
+    >>> [detector.check(state) for state in [0, 1, 2, 3, 4, 2, 3, 4, 2, 3, 4]]
+    [False, False, False, False, False, True, False, False, False, False, True]
+    """
+
+    def __init__(self):
+        self.saved_state: Optional[Tuple[int, int]] = None
+        self.power: int = 1
+        self.num_steps: int = 0
+
+    def check(self, state: Tuple[int, int]) -> bool:
+        """Record the state, True if it matches the saved one
+
+        States hold a hash of memory, so a match means the program has been in the same
+        state before unless two different memories hashed the same.
+        """
+        if state == self.saved_state:
+            return True
+        self.num_steps += 1
+        if self.num_steps == self.power:
+            self.saved_state = state
+            self.power *= 2
+            self.num_steps = 0
+        return False
+
+
 class IntCodeProgram:
-    def __init__(self, command_list: List[str]):
+    def __init__(
+        self,
+        command_list: List[str],
+        output_sink: Optional[OutputSink] = None,
+        detect_loops: bool = False,
+        input_source: Optional["RingBuffer"] = None,
+    ):
         # so we don't modify the input list in place
         self.command_list: List[str] = command_list.copy()
+        self.output_sink: OutputSink = (
+            output_sink if output_sink is not None else PrintSink()
+        )
+        # inputs are read from here if set, otherwise InputCommand.default_input is used
+        self.input_source: Optional[RingBuffer] = input_source
         self.position: int = 0
         self.is_complete: bool = False
-
-    def run(self) -> None:
-        """Run until we reach the exit or encounter an error
+        # set when run stops b/c it used up its instruction budget or time
+        self.is_paused: bool = False
+        # set when run stops b/c the input source is empty or the output sink is full
+        self.is_waiting: bool = False
+        self.num_instructions: int = 0
+        # values taken from input_source so far
+        self.num_inputs_read: int = 0
+        # hash of every write made so far, only kept up to date when detecting loops
+        self.detect_loops: bool = detect_loops
+        self._memory_fingerprint: int = 0
+        self.tracer: Optional["ExecutionTrace"] = None
+        # superinstructions by start address, None where nothing could be fused
+        self._superinstructions: Dict[int, Optional["Superinstruction"]] = {}
+        # every address covered by a superinstruction mapped to its start address
+        self._fused_addresses: Dict[int, int] = {}
+        self.num_deoptimisations: int = 0
+
+    def run(
+        self,
+        max_instructions: Optional[int] = None,
+        timeout: Optional[float] = None,
+        check_every: int = 1000,
+    ) -> None:
+        """Run until we reach the exit, encounter an error, or run out of budget or time
+
+        If the budget or timeout runs out the program is left paused and calling run
+        again carries on from where it stopped. The clock is only checked every
+        `check_every` instructions.
 
         >>> InputCommand.set_default_input("1")
         >>> icp = IntCodeProgram(["3", "9", "8", "9", "10", "9", "4", "9", "99", "-1", "8"])
@@ -311,9 +601,196 @@ class IntCodeProgram:
         >>> icp = IntCodeProgram(["3", "3", "1108", "-1", "8", "3", "4", "3", "99"])
         >>> icp.run()
         1
+        >>> icp = IntCodeProgram(["1105", "1", "0"])
+        >>> icp.run(max_instructions=5000, check_every=64)
+        >>> icp.is_paused, icp.num_instructions
+        (True, 5000)
+        >>> icp.run(timeout=0.01)
+        >>> icp.is_paused, icp.is_complete
+        (True, False)
+        >>> icp = IntCodeProgram(["1001", "7", "1", "7", "1105", "1", "0", "0"],
+        ...                      detect_loops=True)
+        >>> icp.run(max_instructions=10)
+        >>> icp.command_list[7]
+        '5'
+        >>> icp = IntCodeProgram(["1105", "1", "0"], detect_loops=True)
+        >>> icp.run()  # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+        ...
+        InfiniteLoopError: Program loops back to position 0
+        >>> icp.num_instructions
+        1
+
+        A loop that keeps flipping a value comes back to the same memory every other pass
+
+        >>> icp = IntCodeProgram(["1002", "7", "-1", "7", "1105", "1", "0", "1"],
+        ...                      detect_loops=True)
+        >>> icp.run()  # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+        ...
+        InfiniteLoopError: Program loops back to position 0
+        >>> icp.num_instructions
+        6
+
+        Reading an input starts looking for a loop afresh
+
+        >>> icp = IntCodeProgram(["3", "10", "1006", "10", "0", "4", "10", "99", "0", "0",
+        ...                       "0"], output_sink=CollectSink(),
+        ...                      input_source=RingBuffer(3), detect_loops=True)
+        >>> for value in (0, 0, 1):
+        ...     icp.input_source.write(value)
+        >>> icp.run()
+        >>> icp.is_complete, icp.output_sink.values
+        (True, [1])
+
+        :param max_instructions: Optional[int], most instructions to run in this call
+        :param timeout: Optional[float], seconds this call may run for
+        :param check_every: int, instructions between checks of the budget and clock
+        """
+        self.is_paused = False
+        self.is_waiting = False
+        deadline: Optional[float] = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        executed: int = 0
+        loop_detector = LoopDetector()
+        inputs_read: int = self.num_inputs_read
+        try:
+            while not (self.is_complete or self.is_waiting):
+                batch_size: int = check_every
+                if max_instructions is not None:
+                    batch_size = min(batch_size, max_instructions - executed)
+                if batch_size <= 0 or (
+                    deadline is not None and time.monotonic() >= deadline
+                ):
+                    self.is_paused = True
+                    break
+                for _ in range(batch_size):
+                    if self.detect_loops:
+                        # a new input can take the program somewhere else from a state
+                        # it was already in, so only states since the last input count
+                        if self.num_inputs_read != inputs_read:
+                            loop_detector = LoopDetector()
+                            inputs_read = self.num_inputs_read
+                        self._check_for_loop(loop_detector)
+                    self._run_instruction()
+                    if self.is_waiting:
+                        break
+                    executed += 1
+                    if self.is_complete:
+                        break
+        finally:
+            self.num_instructions += executed
+            self.output_sink.flush()
+
+    def run_fused(self) -> None:
+        """Run like `run`, but execute common instruction sequences as superinstructions
+
+        Sequences are fused the first time they are reached. Any write into a fused
+        sequence throws that superinstruction away so the new code is decoded again.
+        Runs normally if a tracer is attached, b/c it records single instructions.
+
+        >>> program = ["1001", "16", "-1", "16", "1007", "16", "1", "17", "1006", "17",
+        ...            "0", "4", "16", "99", "0", "0", "4", "0"]
+        >>> icp = IntCodeProgram(program)
+        >>> icp.run_fused()
+        0
+        >>> sorted(icp._fused_addresses.values())[0], icp.num_deoptimisations
+        (4, 0)
+
+        A program that overwrites the jump in a fused compare and jump
+
+        >>> program = ["1107", "1", "2", "20", "1005", "20", "8", "99", "1101", "15", "0",
+        ...            "6", "1105", "1", "0", "99", "0", "0", "0", "0", "0"]
+        >>> icp = IntCodeProgram(program)
+        >>> icp.run_fused()
+        >>> icp.command_list[6], icp.position, icp.num_deoptimisations
+        ('15', 16, 1)
+
+        A program that jumps into the middle of a fused add chain, then overwrites a
+        parameter the whole chain shares before running it again
+
+        >>> program = ["1101", "0", "0", "40", "1101", "3", "4", "61", "1001", "41",
+        ...            "1", "41", "1007", "41", "2", "42", "1005", "42", "4", "1101",
+        ...            "40", "10", "5", "1007", "41", "3", "42", "1005", "42", "0", "99"]
+        >>> icp = IntCodeProgram(program + ["0"] * 31)
+        >>> icp.run_fused()
+        >>> icp.command_list[61], icp.num_deoptimisations
+        ('54', 2)
+
+        A jump that isn't taken still reads its target, so a bad target fails either way
+
+        >>> program = ["1107", "1", "0", "9", "5", "9", "100", "99", "0", "0"]
+        >>> IntCodeProgram(program).run_fused()  # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+        ...
+        IndexError: list index out of range
+        """
+        if self.tracer is not None:
+            self.run()
+            return
+        superinstructions = self._superinstructions
+        self.is_waiting = False
+        try:
+            while not (self.is_complete or self.is_waiting):
+                position = self.position
+                if position in superinstructions:
+                    fused = superinstructions[position]
+                else:
+                    fused = Superinstruction.fuse(self)
+                    # an address belongs to at most one superinstruction, so a write into
+                    # it always throws away every fused copy of the old code
+                    if fused is not None and any(
+                        (
+                            address in self._fused_addresses
+                            for address in range(position, position + fused.size)
+                        )
+                    ):
+                        fused = None
+                    superinstructions[position] = fused
+                    if fused is not None:
+                        for address in range(position, position + fused.size):
+                            self._fused_addresses[address] = position
+                if fused is None:
+                    self._run_instruction()
+                else:
+                    fused.execute(self)
+        finally:
+            self.output_sink.flush()
+
+    def _write(self, index: int, value: str) -> None:
+        if self.detect_loops:
+            old_value = self.command_list[index]
+            # xor in and out hashes of (index, value) so the order of writes doesn't matter
+            self._memory_fingerprint ^= hash((index, old_value)) ^ hash((index, value))
+        self.command_list[index] = value
+        if self._fused_addresses:
+            # a negative index writes from the end of memory, like the list does
+            if index < 0:
+                index += len(self.command_list)
+            if index in self._fused_addresses:
+                self._deoptimise(self._fused_addresses[index])
+
+    def _check_for_loop(self, loop_detector: LoopDetector) -> None:
+        """Raise InfiniteLoopError if the program is back in a state it was already in
+
+        Memory is compared by a fingerprint of the writes, so only writes made through
+        _write count. A new LoopDetector is used for each call to run, and after every
+        value read from input_source.
         """
-        while not self.is_complete:
-            self._run_instruction()
+        if loop_detector.check((self.position, self._memory_fingerprint)):
+            raise InfiniteLoopError(f"Program loops back to position {self.position}")
+
+    def _deoptimise(self, start: int) -> None:
+        fused = self._superinstructions.pop(start)
+        for address in range(start, start + fused.size):
+            del self._fused_addresses[address]
+        self.num_deoptimisations += 1
+
+    def _read(self, mode: int, param: int) -> int:
+        if mode == 1:
+            return param
+        return int(self.command_list[param])
 
     def _run_instruction(self) -> None:
         """Run a single instruction and increment the position pointer
@@ -329,6 +806,7 @@ class IntCodeProgram:
         >>> assert icp.command_list[4] == "1"
         """
         # get the class for the command
+        start_position: int = self.position
         instr: str = self.command_list[self.position]
         command_class: IntCodeCommand = IntCodeCommand.get_command_from_instruction(
             instr
@@ -336,10 +814,22 @@ class IntCodeProgram:
         # get the arguments we send to the command
         command_params: CommandParams = command_class.get_command_params()
         command_args = self.__get_input_params(instr, command_params)
-        # run the command
-        output_map = command_class.execute(*command_args)
+        # run the command, input and output wait on a connected buffer that isn't ready
+        if self.input_source is not None and isinstance(command_class, InputCommand):
+            if self.input_source.is_empty():
+                self.is_waiting = True
+                return
+            output_map = {command_args[0]: str(self.input_source.read())}
+            self.num_inputs_read += 1
+        else:
+            output_map = command_class.execute(*command_args)
+        if "output" in output_map and self.output_sink.is_full():
+            self.is_waiting = True
+            return
         # update the indices with the value(s) returned from the command
         has_jumped: bool = False
+        write_index: Optional[int] = None
+        write_value: Optional[str] = None
         for index, value in output_map.items():
             # special handling for jump commands
             if index == "position":
@@ -348,11 +838,22 @@ class IntCodeProgram:
             # special handling for exit
             elif index == "exit":
                 self.is_complete = True
+            elif index == "output":
+                self.output_sink.write(value)
             else:
-                self.command_list[index] = value
+                self._write(index, value)
+                write_index, write_value = index, value
         # increment the position appropriately
         if not has_jumped:
             self.position += command_params.num_params + 1
+        if self.tracer is not None:
+            self.tracer.record(
+                start_position,
+                command_class.opcode,
+                self.position,
+                write_index,
+                write_value,
+            )
 
     def __get_input_params(
         self, instr: str, command_params: CommandParams
@@ -421,6 +922,583 @@ class IntCodeProgram:
         return final_args
 
 
+class Instruction:
+    """A decoded instruction
+
+    >>> instr = Instruction.decode(["1001", "9", "-1", "9"], 0)
+    >>> instr
+    0: ADD [9] #-1 -> [9]
+    >>> instr.size, instr.modes, instr.params
+    (4, [0, 1, 0], [9, -1, 9])
+    """
+
+    def __init__(
+        self, address: int, command: IntCodeCommand, modes: List[int], params: List[int]
+    ):
+        self.address: int = address
+        self.command: IntCodeCommand = command
+        self.modes: List[int] = modes
+        self.params: List[int] = params
+
+    @classmethod
+    def decode(cls, command_list: List[str], address: int) -> "Instruction":
+        """Decode the instruction at address, raises UnknownCommandError for bad opcodes
+        and EndOfProgramError if its parameters run past the end of the program"""
+        instr: str = command_list[address]
+        command = IntCodeCommand.get_command_from_instruction(instr)
+        num_params: int = command.get_command_params().num_params
+        if address + num_params >= len(command_list):
+            raise EndOfProgramError(f"Instruction at {address} runs past the end")
+        instr = "0" * (2 + num_params - len(instr)) + instr
+        modes = [int(mode) for mode in instr[:num_params][::-1]]
+        params = [
+            int(arg) for arg in command_list[address + 1 : address + 1 + num_params]
+        ]
+        return cls(address, command, modes, params)
+
+    @property
+    def size(self) -> int:
+        return len(self.params) + 1
+
+    @property
+    def mnemonic(self) -> str:
+        return type(self.command).__name__[: -len("Command")].upper()
+
+    @property
+    def output_addresses(self) -> List[int]:
+        command_params = self.command.get_command_params()
+        return [self.params[i] for i in command_params.output_indices]
+
+    @property
+    def is_jump(self) -> bool:
+        return isinstance(self.command, (JumpIfTrueCommand, JumpIfFalseCommand))
+
+    def __repr__(self) -> str:
+        command_params = self.command.get_command_params()
+        args: List[str] = []
+        for i, (mode, param) in enumerate(zip(self.modes, self.params)):
+            if not command_params.is_index_input(i):
+                args.append(f"-> [{param}]")
+            elif mode == 1:
+                args.append(f"#{param}")
+            else:
+                args.append(f"[{param}]")
+        return " ".join([f"{self.address}: {self.mnemonic}"] + args)
+
+
+class BasicBlock:
+    def __init__(self, start: int):
+        self.start: int = start
+        self.instructions: List[Instruction] = []
+        self.successors: List[int] = []
+        # True when the block ends in a jump whose target could not be worked out
+        self.has_unknown_successor: bool = False
+
+
+class ControlFlowGraph:
+    """Basic blocks of the code reachable from the start of a program
+
+    Decoding follows fall through and jump targets from address 0, so each reachable
+    address is decoded once. Jump targets are known when they are immediate, or when
+    they are read from an address that no instruction in the program ever writes to.
+
+    >>> program = ["1001", "16", "-1", "16", "1005", "16", "0", "1101", "2", "3", "17",
+    ...            "1002", "17", "4", "17", "99", "5", "0"]
+    >>> cfg = ControlFlowGraph(program)
+    >>> for block in cfg.blocks.values():
+    ...     print(block.start, block.instructions, block.successors)
+    0 [0: ADD [16] #-1 -> [16], 4: JUMPIFTRUE [16] #0] [0, 7]
+    7 [7: ADD #2 #3 -> [17], 11: MULTIPLY [17] #4 -> [17], 15: EXIT] []
+    >>> cfg.constant_folds()
+    [(7, 17, 5), (11, 17, 20)]
+    >>> ControlFlowGraph(["1105", "1", "5", "99", "3", "1006", "4", "3"]).blocks[5].successors
+    [3, 8]
+    >>> ControlFlowGraph(["3", "3", "6", "1", "3", "99"]).blocks[0].has_unknown_successor
+    True
+    """
+
+    def __init__(self, command_list: List[str], entry: int = 0):
+        self.command_list: List[str] = command_list
+        self.instructions: Dict[int, Instruction] = {}
+        self.blocks: Dict[int, BasicBlock] = {}
+        self.written_addresses: Set[int] = set()
+        leaders: Set[int] = {entry}
+        to_visit: List[int] = [entry]
+        # jumps whose target is read from an address, waiting until everything else
+        # reachable is decoded, keyed by that address
+        pending_jumps: Dict[int, List[Instruction]] = {}
+        while to_visit:
+            address = to_visit.pop()
+            while 0 <= address < len(command_list) and address not in self.instructions:
+                try:
+                    instr = Instruction.decode(command_list, address)
+                except (UnknownCommandError, EndOfProgramError, ValueError):
+                    break
+                self.instructions[address] = instr
+                for written in instr.output_addresses:
+                    self.written_addresses.add(written)
+                    # written addresses never become unwritten, so these stay unknown
+                    pending_jumps.pop(written, None)
+                if isinstance(instr.command, ExitCommand):
+                    break
+                address += instr.size
+                if instr.is_jump:
+                    if instr.modes[1] == 1:
+                        self._add_target(instr.params[1], leaders, to_visit)
+                    elif instr.params[1] not in self.written_addresses:
+                        pending_jumps.setdefault(instr.params[1], []).append(instr)
+                    leaders.add(address)
+                    to_visit.append(address)
+                    break
+            # once everything known is decoded, follow the jumps we can now resolve
+            if not to_visit:
+                for jumps in pending_jumps.values():
+                    for jump in jumps:
+                        target = self.jump_target(jump)
+                        if target is not None:
+                            self._add_target(target, leaders, to_visit)
+                pending_jumps = {}
+        self._build_blocks(leaders)
+
+    def _add_target(self, target: int, leaders: Set[int], to_visit: List[int]) -> None:
+        leaders.add(target)
+        if target not in self.instructions:
+            to_visit.append(target)
+
+    def jump_target(self, instr: Instruction) -> Optional[int]:
+        """Address a jump goes to, or None if it can't be known before running"""
+        if instr.modes[1] == 1:
+            return instr.params[1]
+        address = instr.params[1]
+        if address in self.written_addresses:
+            return None
+        if not 0 <= address < len(self.command_list):
+            return None
+        try:
+            return int(self.command_list[address])
+        except ValueError:
+            return None
+
+    def _build_blocks(self, leaders: Set[int]) -> None:
+        block: Optional[BasicBlock] = None
+        # address just after the last instruction added to a block
+        block_end: int = -1
+        for address in sorted(self.instructions):
+            instr = self.instructions[address]
+            if block is None or address in leaders or address != block_end:
+                if block is not None and address == block_end:
+                    block.successors.append(address)
+                block = BasicBlock(address)
+                self.blocks[address] = block
+            block.instructions.append(instr)
+            block_end = address + instr.size
+            if instr.is_jump:
+                target = self.jump_target(instr)
+                if target is None:
+                    block.has_unknown_successor = True
+                else:
+                    block.successors.append(target)
+                block.successors.append(block_end)
+                block = None
+            elif isinstance(instr.command, ExitCommand):
+                block = None
+
+    def constant_folds(self) -> List[Tuple[int, int, int]]:
+        """Find arithmetic and comparison instructions whose inputs are all constant
+
+        An input is constant if it is immediate, read from an address no instruction
+        writes to, or written earlier in the same block by another foldable instruction.
+
+        :return: List of (instruction address, output address, folded value)
+        """
+        folds: List[Tuple[int, int, int]] = []
+        foldable = (AddCommand, MultiplyCommand, LessThanCommand, EqualsCommand)
+        for block in self.blocks.values():
+            known: Dict[int, int] = {}
+            for instr in block.instructions:
+                inputs: List[Optional[int]] = []
+                for mode, param in zip(instr.modes[:2], instr.params[:2]):
+                    if mode == 1:
+                        inputs.append(param)
+                    elif param in known:
+                        inputs.append(known[param])
+                    elif param not in self.written_addresses and 0 <= param < len(
+                        self.command_list
+                    ):
+                        inputs.append(int(self.command_list[param]))
+                    else:
+                        inputs.append(None)
+                outputs = instr.output_addresses
+                if isinstance(instr.command, foldable) and None not in inputs:
+                    value = int(instr.command.execute(*inputs, outputs[0])[outputs[0]])
+                    known[outputs[0]] = value
+                    folds.append((instr.address, outputs[0], value))
+                else:
+                    for address in outputs:
+                        known.pop(address, None)
+        return folds
+
+
+class Superinstruction:
+    """A sequence of decoded instructions run as a single step of IntCodeProgram.run_fused
+
+    Sequences are never fused if they write into their own addresses, start at a
+    negative address, or read a parameter in a mode other than position or immediate,
+    so every error is left to the plain interpreter. A superinstruction reads every
+    parameter the plain instructions would, so it fails wherever they fail, but it
+    leaves the position at its own start rather than at the instruction that failed.
+    """
+
+    def __init__(self, instructions: List[Instruction]):
+        self.instructions: List[Instruction] = instructions
+        self.start: int = instructions[0].address
+        self.size: int = sum(instr.size for instr in instructions)
+
+    @staticmethod
+    def fuse(program: "IntCodeProgram") -> Optional["Superinstruction"]:
+        """Look for a fusable sequence at the program's position, None if there isn't one
+
+        An add chain stops before the first instruction that would write into it
+
+        >>> program = ["1101", "1", "2", "20", "1101", "1", "2", "21", "1101", "5", "0",
+        ...            "1", "99"]
+        >>> Superinstruction.fuse(IntCodeProgram(program + ["0"] * 10)).size
+        8
+        """
+        instructions: List[Instruction] = []
+        address: int = program.position
+        if address < 0:
+            return None
+        try:
+            first = Instruction.decode(program.command_list, address)
+            if isinstance(first.command, (LessThanCommand, EqualsCommand)):
+                jump = Instruction.decode(program.command_list, address + first.size)
+                if jump.is_jump:
+                    instructions = [first, jump]
+            elif isinstance(first.command, (AddCommand, MultiplyCommand)):
+                instr = first
+                # stop before an instruction that would make the chain write into itself
+                # so the rest of it can still be fused
+                while (
+                    len(instructions) < MAX_CHAIN_LENGTH
+                    and isinstance(instr.command, (AddCommand, MultiplyCommand))
+                    and not Superinstruction._writes_into(
+                        instructions + [instr], program.position, address + instr.size
+                    )
+                ):
+                    instructions.append(instr)
+                    address += instr.size
+                    instr = Instruction.decode(program.command_list, address)
+        except (UnknownCommandError, EndOfProgramError, ValueError, IndexError):
+            pass
+        # the plain interpreter skips parameters with an unknown mode and then fails
+        for i, instr in enumerate(instructions):
+            if not Superinstruction._has_known_modes(instr):
+                instructions = instructions[:i]
+                break
+        if len(instructions) < 2:
+            return None
+        end: int = instructions[-1].address + instructions[-1].size
+        if Superinstruction._writes_into(instructions, program.position, end):
+            return None
+        if instructions[-1].is_jump:
+            return CompareJump(instructions)
+        return ArithmeticChain(instructions)
+
+    @staticmethod
+    def _has_known_modes(instr: Instruction) -> bool:
+        command_params: CommandParams = instr.command.get_command_params()
+        return all(
+            (
+                mode in (0, 1)
+                for index, mode in enumerate(instr.modes)
+                if command_params.is_index_input(index)
+            )
+        )
+
+    @staticmethod
+    def _writes_into(instructions: List[Instruction], start: int, end: int) -> bool:
+        return any(
+            (
+                start <= out < end
+                for instr in instructions
+                for out in instr.output_addresses
+            )
+        )
+
+    def execute(self, program: "IntCodeProgram") -> None:
+        raise NotImplementedError("Cannot run 'execute' on base Superinstruction class")
+
+
+class CompareJump(Superinstruction):
+    """LessThan or Equals followed by JumpIfTrue or JumpIfFalse"""
+
+    def __init__(self, instructions: List[Instruction]):
+        super().__init__(instructions)
+        compare, jump = instructions
+        self.is_less_than: bool = isinstance(compare.command, LessThanCommand)
+        self.jump_if_true: bool = isinstance(jump.command, JumpIfTrueCommand)
+        self.compare_args = list(zip(compare.modes[:2], compare.params[:2]))
+        self.out_index: int = compare.params[2]
+        self.check_arg = (jump.modes[0], jump.params[0])
+        self.target_arg = (jump.modes[1], jump.params[1])
+
+    def execute(self, program: "IntCodeProgram") -> None:
+        (mode_1, param_1), (mode_2, param_2) = self.compare_args
+        num1 = program._read(mode_1, param_1)
+        num2 = program._read(mode_2, param_2)
+        result = num1 < num2 if self.is_less_than else num1 == num2
+        program._write(self.out_index, "1" if result else "0")
+        # the jump usually checks the comparison, but it can read anything, and the
+        # target is read even when the jump isn't taken, like the plain interpreter does
+        check = program._read(*self.check_arg)
+        target = program._read(*self.target_arg)
+        if (check != 0) == self.jump_if_true:
+            program.position = target
+        else:
+            program.position = self.start + self.size
+
+
+class ArithmeticChain(Superinstruction):
+    """Run of Add and Multiply instructions"""
+
+    def __init__(self, instructions: List[Instruction]):
+        super().__init__(instructions)
+        self.steps = [
+            (
+                isinstance(instr.command, AddCommand),
+                instr.modes[0],
+                instr.params[0],
+                instr.modes[1],
+                instr.params[1],
+                instr.params[2],
+            )
+            for instr in instructions
+        ]
+
+    def execute(self, program: "IntCodeProgram") -> None:
+        read = program._read
+        for is_add, mode_1, param_1, mode_2, param_2, out_index in self.steps:
+            if is_add:
+                result = read(mode_1, param_1) + read(mode_2, param_2)
+            else:
+                result = read(mode_1, param_1) * read(mode_2, param_2)
+            program._write(out_index, str(result))
+        program.position = self.start + self.size
+
+
+class ExecutionTrace:
+    """Records every instruction an IntCodeProgram runs so any point can be replayed later
+
+    Each instruction is stored as the program counter as a delta from the previous
+    one, the opcode, the next program counter as a delta, and the memory write it made
+    if any, as an index delta and value. Instructions with no write or a single write
+    that fits in 64 bits are packed into one fixed size struct, anything else falls
+    back to zigzag varints. Records are grouped into blocks that each start with a
+    snapshot of memory, and only the newest `max_blocks` blocks are kept, so memory use
+    stays bounded however long the program runs.
+
+    >>> InputCommand.set_default_input("7")
+    >>> icp = IntCodeProgram(["3", "9", "8", "9", "10", "9", "4", "9", "99", "-1", "8"])
+    >>> trace = ExecutionTrace(icp, snapshot_every=2)
+    >>> icp.run()
+    0
+    >>> trace.num_instructions
+    4
+    >>> for record in trace.records():
+    ...     print(record)
+    (0, 0, 3, 2, [(9, 7)])
+    (1, 2, 8, 6, [(9, 0)])
+    (2, 6, 4, 8, [])
+    (3, 8, 99, 9, [])
+    >>> replayed = trace.seek(1)
+    >>> replayed.position, replayed.command_list[9]
+    (2, '7')
+    >>> trace.seek(4).is_complete
+    True
+    >>> icp = IntCodeProgram(["1102", "10000000000", "10000000000", "5", "99", "0"])
+    >>> trace = ExecutionTrace(icp)
+    >>> icp.run()
+    >>> list(trace.records())
+    [(0, 0, 2, 4, [(5, 100000000000000000000)]), (1, 4, 99, 5, [])]
+    """
+
+    def __init__(
+        self,
+        program: "IntCodeProgram",
+        snapshot_every: int = 1024,
+        max_blocks: int = 64,
+    ):
+        self.snapshot_every: int = snapshot_every
+        self.blocks: Deque[_TraceBlock] = deque(maxlen=max_blocks)
+        self.num_instructions: int = 0
+        self._program: "IntCodeProgram" = program
+        self._start_block()
+        program.tracer = self
+
+    def _start_block(self) -> None:
+        self.blocks.append(_TraceBlock(self.num_instructions, self._program))
+        self._data: bytearray = self.blocks[-1].data
+        # pc deltas restart from the snapshot so each block decodes on its own
+        self._previous_pc = self._program.position
+
+    @property
+    def first_available(self) -> int:
+        """Earliest instruction number that can still be sought to"""
+        return self.blocks[0].start
+
+    def record(
+        self,
+        pc: int,
+        opcode: int,
+        next_pc: int,
+        write_index: Optional[int] = None,
+        write_value: Optional[str] = None,
+    ) -> None:
+        """Append a record for an instruction that made at most one memory write"""
+        pc_delta: int = pc - self._previous_pc
+        try:
+            if write_index is None:
+                self._data.extend(
+                    _NO_WRITE_RECORD.pack(_NO_WRITE, pc_delta, opcode, next_pc - pc)
+                )
+            else:
+                self._data.extend(
+                    _ONE_WRITE_RECORD.pack(
+                        _ONE_WRITE,
+                        pc_delta,
+                        opcode,
+                        next_pc - pc,
+                        write_index - pc,
+                        int(write_value),
+                    )
+                )
+        except struct.error:
+            self._data.append(_VARINT_WRITES)
+            for value in (pc_delta, opcode, next_pc - pc):
+                _write_varint(self._data, value)
+            if write_index is None:
+                _write_varint(self._data, 0)
+            else:
+                _write_varint(self._data, 1)
+                _write_varint(self._data, write_index - pc)
+                _write_varint(self._data, int(write_value))
+        self._previous_pc = pc
+        self.num_instructions += 1
+        if self.num_instructions % self.snapshot_every == 0:
+            self._start_block()
+
+    def records(self) -> Iterator[Tuple[int, int, int, int, List[Tuple[int, int]]]]:
+        """Yield (instruction number, pc, opcode, next pc, writes) for every kept record"""
+        for block in self.blocks:
+            yield from block.records()
+
+    def seek(self, instruction_number: int) -> "IntCodeProgram":
+        """Rebuild the program as it was after `instruction_number` instructions ran
+
+        Starts from the closest snapshot at or before that point and applies the
+        recorded writes, without running any instructions.
+        """
+        if not self.first_available <= instruction_number <= self.num_instructions:
+            raise IndexError(f"Instruction {instruction_number} is not in the trace")
+        block = [b for b in self.blocks if b.start <= instruction_number][-1]
+        program = IntCodeProgram(block.memory)
+        program.position = block.position
+        program.is_complete = block.is_complete
+        for number, _, opcode, next_pc, writes in block.records():
+            if number >= instruction_number:
+                break
+            for index, value in writes:
+                program.command_list[index] = str(value)
+            program.position = next_pc
+            program.is_complete = opcode == 99
+        return program
+
+
+class _TraceBlock:
+    """Snapshot of a program plus the encoded records of the instructions run after it"""
+
+    def __init__(self, start: int, program: "IntCodeProgram"):
+        self.start: int = start
+        self.memory: List[str] = program.command_list.copy()
+        self.position: int = program.position
+        self.is_complete: bool = program.is_complete
+        self.data: bytearray = bytearray()
+
+    def records(self) -> Iterator[Tuple[int, int, int, int, List[Tuple[int, int]]]]:
+        data: bytes = bytes(self.data)
+        offset: int = 0
+        number: int = self.start
+        pc: int = self.position
+        while offset < len(data):
+            kind: int = data[offset]
+            writes: List[Tuple[int, int]] = []
+            if kind == _NO_WRITE:
+                _, pc_delta, opcode, next_delta = _NO_WRITE_RECORD.unpack_from(
+                    data, offset
+                )
+                offset += _NO_WRITE_RECORD.size
+                pc += pc_delta
+            elif kind == _ONE_WRITE:
+                _, pc_delta, opcode, next_delta, index_delta, value = (
+                    _ONE_WRITE_RECORD.unpack_from(data, offset)
+                )
+                offset += _ONE_WRITE_RECORD.size
+                pc += pc_delta
+                writes.append((pc + index_delta, value))
+            else:
+                pc_delta, offset = _read_varint(data, offset + 1)
+                pc += pc_delta
+                opcode, offset = _read_varint(data, offset)
+                next_delta, offset = _read_varint(data, offset)
+                num_writes, offset = _read_varint(data, offset)
+                for _ in range(num_writes):
+                    index_delta, offset = _read_varint(data, offset)
+                    value, offset = _read_varint(data, offset)
+                    writes.append((pc + index_delta, value))
+            yield number, pc, opcode, pc + next_delta, writes
+            number += 1
+
+
+# kind byte, pc delta, opcode, next pc delta, then the write's index delta and value
+_NO_WRITE, _ONE_WRITE, _VARINT_WRITES = range(3)
+_NO_WRITE_RECORD = struct.Struct("<BiBi")
+_ONE_WRITE_RECORD = struct.Struct("<BiBiiq")
+
+
+def _write_varint(data: bytearray, value: int) -> None:
+    """Append a zigzag encoded varint, small values of either sign take a single byte"""
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value >= 0x80:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    data.append(value)
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """
+    >>> data = bytearray()
+    >>> for num in [0, -1, 63, -64, 300, -123456789]:
+    ...     _write_varint(data, num)
+    >>> offset, nums = 0, []
+    >>> while offset < len(data):
+    ...     num, offset = _read_varint(data, offset)
+    ...     nums.append(num)
+    >>> nums, len(data)
+    ([0, -1, 63, -64, 300, -123456789], 10)
+    """
+    value: int = 0
+    shift: int = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1) if not value & 1 else -(value >> 1) - 1, offset
+
+
 def parse_input(input_path: Path) -> List[str]:
     if not input_path.exists():
         print(f"Bad input path. '{input_path}' does not exist.")
@@ -441,6 +1519,7 @@ def build_arg_parser() -> ArgumentParser:
     arg_parser.add_argument(
         "-t", "--test", help="Run the tests for this solution", action="store_true"
     )
+    add_profiling_args(arg_parser)
     return arg_parser
 
 
@@ -456,17 +1535,22 @@ def run(arg_parser: ArgumentParser) -> None:
             return
 
     if not args.test or args.run:
+        timings = StageTimings.from_args(Path(__file__).stem, args)
         print("Parsing input...")
-        parsed_input = parse_input(Path(args.input))
+        with timings.stage("parse"):
+            parsed_input = parse_input(Path(args.input))
         if not parsed_input:
             print("Could not parse input.")
             return
         print("Computing answer for part 1...")
-        answer_1 = main_1(parsed_input)
+        with timings.stage("part_1"):
+            answer_1 = main_1(parsed_input)
         print(f"Answer for part 1: {answer_1}")
         print("Computing answer for part 2...")
-        answer_2 = main_2(parsed_input)
+        with timings.stage("part_2"):
+            answer_2 = main_2(parsed_input)
         print(f"Answer for part 2: {answer_2}")
+        timings.report()
 
 
 if __name__ == "__main__":
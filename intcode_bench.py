@@ -0,0 +1,522 @@
+"""Differential tests and benchmarks for every Intcode engine in the repo
+
+Random valid programs from a seeded generator are run on each engine that supports
+the instructions they use, along with corrupted copies of them that stop on an error
+or run off the end of memory. Every engine has to leave the same memory and outputs,
+or raise the same error,
+and keep up with its recorded baseline. Rates are measured against a fixed Python
+loop timed alongside the engines, so a baseline recorded on one machine holds on
+another.
+"""
+from argparse import ArgumentParser
+import doctest
+import functools
+import json
+from pathlib import Path
+import random
+import sys
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import day_2
+import day_5
+
+DEFAULT_BASELINE_PATH = "intcode_baseline.json"
+
+# opcodes day 2 can run, and the ones day 5 added
+ARITHMETIC_OPCODES: Tuple[int, ...] = (1, 2)
+DAY_5_OPCODES: Tuple[int, ...] = (1, 2, 3, 4, 5, 6, 7, 8)
+OPCODE_SIZES: Dict[int, int] = {1: 4, 2: 4, 3: 2, 4: 2, 5: 3, 6: 3, 7: 4, 8: 4}
+
+# final memory and outputs, or the error raised, and the seconds spent running
+EngineResult = Tuple[Any, float]
+
+
+class RandomProgram:
+    """A program that always exits, laid out as code, then constants, then variables
+
+    Forward jumps only skip a few instructions. Backward jumps only close loops, each
+    driven by its own counter that only ever goes up, so no loop runs more than 20
+    times. Arithmetic results are written to the variables, and patches write the
+    address of a constant over a parameter that is read, so the code changes as it runs
+    but stays valid.
+    """
+
+    def __init__(
+        self,
+        memory: List[int],
+        inputs: List[int],
+        opcodes: Set[int],
+        is_valid: bool = True,
+    ):
+        self.memory: List[int] = memory
+        self.inputs: List[int] = inputs
+        self.opcodes: Set[int] = opcodes
+        # False once corrupted, so it may run bad opcodes, modes or addresses
+        self.is_valid: bool = is_valid
+
+
+def random_program(
+    seed: int,
+    num_instructions: int = 50,
+    opcodes: Sequence[int] = ARITHMETIC_OPCODES,
+    num_variables: int = 8,
+) -> RandomProgram:
+    """
+    >>> program = random_program(0, num_instructions=3)
+    >>> program.memory.index(99), program.opcodes <= {1, 2}
+    (12, True)
+    >>> random_program(0, num_instructions=3).memory == program.memory
+    True
+    >>> random_program(1, opcodes=DAY_5_OPCODES).opcodes <= set(DAY_5_OPCODES)
+    True
+    """
+    rng = random.Random(seed)
+    use_modes: bool = any((opcode > 2 for opcode in opcodes))
+    # loops are closed with less than and jump if true
+    use_loops: bool = {5, 7} <= set(opcodes)
+    sizes: Dict[str, int] = {"patch": 4, "loop_start": 4, "loop_end": 11}
+    sizes.update({str(opcode): size for opcode, size in OPCODE_SIZES.items()})
+
+    # plan the code as (kind, loop number) first, so every address is known up front
+    plan: List[Tuple[str, int]] = []
+    num_loops: int = 0
+    loop_left: int = 0
+    for _ in range(num_instructions):
+        if use_loops and not loop_left and rng.random() < 0.2:
+            plan.append(("loop_start", num_loops))
+            loop_left = rng.randint(2, 6)
+        if rng.random() < 0.05:
+            plan.append(("patch", 0))
+        else:
+            opcode: int = rng.choice(opcodes)
+            # an input in a loop could be read more times than there are inputs
+            while loop_left and opcode == 3:
+                opcode = rng.choice(opcodes)
+            plan.append((str(opcode), num_loops))
+        if loop_left:
+            loop_left -= 1
+            if not loop_left:
+                plan.append(("loop_end", num_loops))
+                num_loops += 1
+    if loop_left:
+        plan.append(("loop_end", num_loops))
+        num_loops += 1
+
+    addresses: List[int] = []
+    exit_position: int = 0
+    for kind, _ in plan:
+        addresses.append(exit_position)
+        exit_position += sizes[kind]
+    # forward jumps can land on any instruction that isn't part of a loop's counter
+    targets: List[int] = [
+        address
+        for address, (kind, _) in zip(addresses, plan)
+        if not kind.startswith("loop")
+    ]
+    constants_start: int = exit_position + 1
+    constants: List[int] = [rng.randint(0, 9) for _ in range(num_variables)]
+    # a zero, then addresses of constants for patches to add to it
+    pointers_start: int = constants_start + len(constants)
+    pointers: List[int] = [0] + [
+        rng.randrange(constants_start, pointers_start) for _ in range(3)
+    ]
+    # a counter and a flag for each loop, never written by anything else
+    counters_start: int = pointers_start + len(pointers)
+    variables_start: int = counters_start + 2 * num_loops
+    variables: List[int] = [rng.randint(0, 9) for _ in range(num_variables)]
+
+    def variable() -> int:
+        return rng.randrange(variables_start, variables_start + num_variables)
+
+    def readable(constant_only: bool = False) -> Tuple[int, int]:
+        """Mode and parameter for an input, immediate only if modes are in use"""
+        if use_modes and rng.random() < 0.3:
+            return 1, rng.randint(0, 3)
+        if constant_only or rng.random() < 0.5:
+            return 0, rng.randrange(constants_start, pointers_start)
+        return 0, variable()
+
+    code: List[int] = []
+    inputs: List[int] = []
+    # addresses of parameters that patches may overwrite, and the patches to fill in
+    patchable: List[int] = []
+    patches: List[int] = []
+    loop_starts: Dict[int, int] = {}
+    used: Set[int] = set()
+    for address, (kind, loop) in zip(addresses, plan):
+        counter: int = counters_start + 2 * loop
+        if kind == "patch":
+            pointer: int = pointers_start + rng.randrange(1, len(pointers))
+            code.extend([1, pointers_start, pointer, 0])
+            patches.append(address + 3)
+            used.add(1)
+        elif kind == "loop_start":
+            code.extend([1101, 0, 0, counter])
+            loop_starts[loop] = address + sizes[kind]
+            used.add(1)
+        elif kind == "loop_end":
+            limit: int = rng.randint(2, 20)
+            code.extend([1001, counter, 1, counter])
+            code.extend([1007, counter, limit, counter + 1])
+            code.extend([1005, counter + 1, loop_starts[loop]])
+            used.update((1, 5, 7))
+        else:
+            opcode = int(kind)
+            used.add(opcode)
+            if opcode in (1, 2, 7, 8):
+                mode_1, param_1 = readable()
+                # multiplying only by constants keeps the values from growing too fast
+                mode_2, param_2 = readable(constant_only=opcode == 2)
+                instr: int = opcode + 100 * mode_1 + 1000 * mode_2
+                code.extend([instr, param_1, param_2, variable()])
+                patchable.append(address + 1)
+                if opcode != 2:
+                    patchable.append(address + 2)
+            elif opcode == 3:
+                code.extend([opcode, variable()])
+                inputs.append(rng.randint(-9, 9))
+            elif opcode == 4:
+                mode_1, param_1 = readable()
+                code.extend([opcode + 100 * mode_1, param_1])
+                patchable.append(address + 1)
+            else:
+                mode_1, param_1 = readable()
+                # short jumps, so most of the code still runs
+                later: List[int] = [target for target in targets if target > address]
+                target: int = rng.choice((later + [exit_position])[:8])
+                code.extend([opcode + 100 * mode_1 + 1000, param_1, target])
+                patchable.append(address + 1)
+    for patch in patches:
+        code[patch] = rng.choice(patchable) if patchable else variable()
+    memory: List[int] = (
+        code + [99] + constants + pointers + [0] * (2 * num_loops) + variables
+    )
+    return RandomProgram(memory, inputs, used)
+
+
+def corrupted_program(
+    seed: int, num_instructions: int = 50, max_instructions: int = 100000
+) -> Optional[RandomProgram]:
+    """A day 5 random program with a few words overwritten by out of range addresses
+    or random instructions, None if day 5's engine doesn't stop within
+    `max_instructions`, since the corruption can make it loop forever
+
+    >>> program = corrupted_program(3)
+    >>> original = random_program(3, opcodes=DAY_5_OPCODES)
+    >>> program.is_valid, program.memory == original.memory
+    (False, False)
+    >>> corrupted_program(3).memory == program.memory
+    True
+    """
+    program = random_program(seed, num_instructions, DAY_5_OPCODES)
+    memory: List[int] = program.memory.copy()
+    rng = random.Random(f"corrupted {seed}")
+    for _ in range(rng.randint(1, 5)):
+        address: int = rng.randrange(len(memory))
+        if rng.random() < 0.5:
+            memory[address] = rng.randint(-3, len(memory) + 3)
+        else:
+            opcode: int = rng.choice(DAY_5_OPCODES + (0, 9, 99))
+            modes: int = sum((rng.randint(0, 2) * 10**i for i in range(3)))
+            memory[address] = opcode + 100 * modes
+    reference = day_5.IntCodeProgram(
+        [str(value) for value in memory],
+        output_sink=day_5.CollectSink(),
+        input_source=_filled_buffer(program.inputs),
+    )
+    try:
+        reference.run(max_instructions=max_instructions)
+    except Exception:
+        pass
+    if reference.is_paused:
+        return None
+    return RandomProgram(memory, program.inputs, program.opcodes, is_valid=False)
+
+
+class Engine:
+    """An Intcode interpreter, wrapped to take and give back memory as ints"""
+
+    def __init__(
+        self,
+        name: str,
+        opcodes: Sequence[int],
+        run_func: Callable[[RandomProgram], Tuple[List[int], List[int], float]],
+        runs_invalid: bool = False,
+    ):
+        self.name: str = name
+        self.opcodes: Set[int] = set(opcodes)
+        self.run_func = run_func
+        # only engines that raise the same errors can be compared on invalid programs
+        self.runs_invalid: bool = runs_invalid
+
+    def supports(self, program: RandomProgram) -> bool:
+        if not (program.is_valid or self.runs_invalid):
+            return False
+        return program.opcodes <= self.opcodes
+
+    def run(self, program: RandomProgram) -> EngineResult:
+        """Memory and outputs, or the error raised, and the seconds spent running"""
+        try:
+            memory, outputs, seconds = self.run_func(program)
+        except Exception as e:
+            return repr(e), 0.0
+        return (memory, outputs), seconds
+
+
+def _run_day_2(program: RandomProgram) -> Tuple[List[int], List[int], float]:
+    icp = day_2.IntCodeProgram(program.memory)
+    start: float = time.perf_counter()
+    icp.run()
+    seconds: float = time.perf_counter() - start
+    return icp.command_list, [], seconds
+
+
+def _run_day_5(
+    program: RandomProgram, fused: bool = False
+) -> Tuple[List[int], List[int], float]:
+    sink = day_5.CollectSink()
+    icp = day_5.IntCodeProgram(
+        [str(value) for value in program.memory],
+        output_sink=sink,
+        input_source=_filled_buffer(program.inputs),
+    )
+    start: float = time.perf_counter()
+    if fused:
+        icp.run_fused()
+    else:
+        icp.run()
+    seconds: float = time.perf_counter() - start
+    if not icp.is_complete:
+        raise day_5.EndOfProgramError(f"Stopped at position {icp.position}")
+    return [int(value) for value in icp.command_list], sink.values, seconds
+
+
+ENGINES: List[Engine] = [
+    Engine("day_2", ARITHMETIC_OPCODES, _run_day_2),
+    Engine("day_5", DAY_5_OPCODES, _run_day_5, runs_invalid=True),
+    Engine(
+        "day_5_fused",
+        DAY_5_OPCODES,
+        functools.partial(_run_day_5, fused=True),
+        runs_invalid=True,
+    ),
+]
+
+
+def corpus(
+    seeds: Sequence[int], num_instructions: int = 50, include_invalid: bool = False
+) -> Iterator[Tuple[int, RandomProgram]]:
+    """Programs for every seed, alternating between day 2's and day 5's opcodes, plus
+    a corrupted copy of every day 5 program that stops if `include_invalid` is set"""
+    for seed in seeds:
+        opcodes = ARITHMETIC_OPCODES if seed % 2 == 0 else DAY_5_OPCODES
+        yield seed, random_program(seed, num_instructions, opcodes)
+        if include_invalid and opcodes == DAY_5_OPCODES:
+            corrupted = corrupted_program(seed, num_instructions)
+            if corrupted is not None:
+                yield seed, corrupted
+
+
+def find_mismatches(
+    seeds: Sequence[int],
+    num_instructions: int = 50,
+    engines: Optional[List[Engine]] = None,
+) -> List[str]:
+    """Describe every program where the engines that can run it disagree
+
+    >>> find_mismatches(range(40))
+    []
+    >>> def broken(program):
+    ...     memory, outputs, seconds = _run_day_2(program)
+    ...     return memory[:-1] + [memory[-1] + 1], outputs, seconds
+    >>> find_mismatches(range(2), engines=ENGINES + [Engine("broken", [1, 2], broken)])
+    ['seed 0: broken differs from day_2']
+    """
+    engines = engines if engines is not None else ENGINES
+    mismatches: List[str] = []
+    for seed, program in corpus(seeds, num_instructions, include_invalid=True):
+        label: str = f"seed {seed}" if program.is_valid else f"corrupted seed {seed}"
+        reference: Optional[Tuple[str, Any]] = None
+        for engine in engines:
+            if not engine.supports(program):
+                continue
+            result, _ = engine.run(program)
+            if reference is None:
+                reference = (engine.name, result)
+            elif result != reference[1]:
+                mismatches.append(f"{label}: {engine.name} differs from {reference[0]}")
+    return mismatches
+
+
+def measure_rates(
+    seeds: Sequence[int],
+    num_instructions: int = 500,
+    engines: Optional[List[Engine]] = None,
+    calibration_iterations: int = 20000,
+) -> Dict[str, float]:
+    """Instructions each engine runs per iteration of a fixed calibration loop, over
+    every program it supports
+
+    The calibration loop runs between the programs, so both are timed with the
+    machine at the same speed and the rates hold from one machine to the next.
+    Instructions are counted by running each program once more on the day 5 engine,
+    since not every engine counts them itself.
+
+    >>> rates = measure_rates(range(4), num_instructions=20, calibration_iterations=100)
+    >>> sorted(rates), all((rate > 0 for rate in rates.values()))
+    (['day_2', 'day_5', 'day_5_fused'], True)
+    """
+    engines = engines if engines is not None else ENGINES
+    num_executed: Dict[str, int] = {engine.name: 0 for engine in engines}
+    seconds: Dict[str, float] = {engine.name: 0.0 for engine in engines}
+    calibration_seconds: float = 0.0
+    num_programs: int = 0
+    for _, program in corpus(seeds, num_instructions):
+        num_programs += 1
+        calibration_seconds += _calibration_seconds(calibration_iterations)
+        counter = day_5.IntCodeProgram(
+            [str(value) for value in program.memory],
+            output_sink=day_5.CollectSink(),
+            input_source=_filled_buffer(program.inputs),
+        )
+        counter.run()
+        for engine in engines:
+            if engine.supports(program):
+                _, run_seconds = engine.run(program)
+                num_executed[engine.name] += counter.num_instructions
+                seconds[engine.name] += run_seconds
+    calibration_rate: float = (
+        num_programs * calibration_iterations / calibration_seconds
+    )
+    return {
+        name: num_executed[name] / seconds[name] / calibration_rate
+        for name in num_executed
+        if seconds[name] > 0
+    }
+
+
+def _calibration_seconds(num_iterations: int) -> float:
+    """Seconds taken by a fixed loop doing the kind of work an interpreter does"""
+    memory: List[str] = [str(value) for value in range(100)]
+    start: float = time.perf_counter()
+    total: int = 0
+    for i in range(num_iterations):
+        total += int(memory[i % 100])
+    return time.perf_counter() - start
+
+
+def _filled_buffer(values: List[int]) -> day_5.RingBuffer:
+    buffer = day_5.RingBuffer(max(1, len(values)))
+    for value in values:
+        buffer.write(value)
+    return buffer
+
+
+def below_baseline(
+    rates: Dict[str, float], baseline: Dict[str, float], tolerance: float = 0.25
+) -> List[str]:
+    """Describe every engine slower than its baseline by more than `tolerance`
+
+    Rates are instructions run per iteration of the calibration loop in measure_rates.
+    Engines without a baseline, or missing from this run, are not checked.
+
+    >>> below_baseline({"day_2": 0.7, "day_5": 0.09}, {"day_2": 1.0, "day_5": 0.1})
+    ['day_2: 0.7 instructions/calibration, baseline 1']
+    """
+    failures: List[str] = []
+    for name, rate in rates.items():
+        expected: Optional[float] = baseline.get(name)
+        if expected is not None and rate < expected * (1 - tolerance):
+            failures.append(
+                f"{name}: {rate:.3g} instructions/calibration, baseline {expected:.3g}"
+            )
+    return failures
+
+
+def build_arg_parser() -> ArgumentParser:
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument(
+        "-t", "--test", help="Run the tests for the harness", action="store_true"
+    )
+    arg_parser.add_argument(
+        "-s", "--seeds", type=int, default=200, help="Number of random programs"
+    )
+    arg_parser.add_argument(
+        "-n",
+        "--num-instructions",
+        type=int,
+        default=500,
+        help="Instructions in each random program",
+    )
+    arg_parser.add_argument(
+        "-b",
+        "--baseline",
+        help="Path for the JSON file of relative rates for each engine",
+        default=DEFAULT_BASELINE_PATH,
+    )
+    arg_parser.add_argument(
+        "--record",
+        help="Save this run's relative rates as the new baseline",
+        action="store_true",
+    )
+    arg_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Fraction below its baseline an engine may run before failing",
+    )
+    return arg_parser
+
+
+def run(arg_parser: ArgumentParser) -> None:
+    args = arg_parser.parse_args()
+
+    if args.test:
+        print("Running Tests...")
+        failures, num_tests = doctest.testmod()
+        if not failures:
+            print(f"Ran {num_tests} test, 0 failures")
+        else:
+            sys.exit(1)
+        return
+
+    seeds = range(args.seeds)
+    print("Comparing engines...")
+    mismatches = find_mismatches(seeds, args.num_instructions)
+    for mismatch in mismatches:
+        print(mismatch)
+    print("Measuring engines...")
+    rates = measure_rates(seeds, args.num_instructions)
+    print(json.dumps(rates))
+    baseline_path = Path(args.baseline)
+    if args.record:
+        recorded = {name: round(rate, 4) for name, rate in rates.items()}
+        baseline_path.write_text(json.dumps(recorded, indent=2, sort_keys=True) + "\n")
+        print(f"Saved baseline to '{baseline_path}'")
+        slow: List[str] = []
+    elif baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+        slow = below_baseline(rates, baseline, args.tolerance)
+        for failure in slow:
+            print(failure)
+    else:
+        print(f"No baseline at '{baseline_path}', run with --record to save one")
+        slow = []
+    if mismatches or slow:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = build_arg_parser()
+    run(parser)
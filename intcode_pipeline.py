@@ -0,0 +1,326 @@
+"""Runs Intcode programs chained output to input through bounded buffers, like the
+amplifiers in https://adventofcode.com/2019/day/7/
+
+Each stage is a day_5 IntCodeProgram reading from the buffer the stage before it
+writes to. A stage waits when its input buffer is empty or its output buffer is
+full, and the scheduler only runs stages that are ready.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import doctest
+import functools
+import itertools
+import json
+from pathlib import Path
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from day_5 import (
+    InputCommand,
+    IntCodeCommand,
+    IntCodeProgram,
+    RingBuffer,
+    parse_input,
+)
+
+DEFAULT_INPUT_FILE_PATH = "input_7.txt"
+
+
+class DeadlockError(Exception):
+    pass
+
+
+class PipelineStage:
+    """One program in a pipeline and how long it spent waiting on its neighbours"""
+
+    def __init__(self, name: str, program: IntCodeProgram):
+        self.name: str = name
+        self.program: IntCodeProgram = program
+        self.stall_seconds: float = 0.0
+        self.num_stalls: int = 0
+        self._stalled_since: Optional[float] = None
+
+    def is_ready(self) -> bool:
+        """True if running the program now would execute at least one instruction"""
+        program = self.program
+        if program.is_complete:
+            return False
+        if not program.is_waiting:
+            return True
+        # a waiting program is stopped in front of the input or output it waits on
+        command = IntCodeCommand.get_command_from_instruction(
+            program.command_list[program.position]
+        )
+        if isinstance(command, InputCommand):
+            return not program.input_source.is_empty()
+        return not program.output_sink.is_full()
+
+    def run(self, max_instructions: int) -> None:
+        if self._stalled_since is not None:
+            self.stall_seconds += time.perf_counter() - self._stalled_since
+            self._stalled_since = None
+        self.program.run(max_instructions=max_instructions)
+        if self.program.is_waiting:
+            self.num_stalls += 1
+            self._stalled_since = time.perf_counter()
+
+
+class Pipeline:
+    """Programs connected in a chain, or a loop if `feedback` is set
+
+    Each stage first reads its phase setting, then the first stage reads 0. Without
+    feedback the last stage's outputs are collected, with feedback they go back to
+    the first stage and whatever is left over once every stage exits is collected.
+
+    >>> program = "3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0".split(",")
+    >>> pipeline = Pipeline(program, [4, 3, 2, 1, 0])
+    >>> pipeline.run()
+    43210
+    >>> report = pipeline.report()
+    >>> report["num_instructions"], [stage["name"] for stage in report["stages"]]
+    (30, ['stage_0', 'stage_1', 'stage_2', 'stage_3', 'stage_4'])
+
+    >>> program = (
+    ...     "3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,4,27,"
+    ...     "1001,28,-1,28,1005,28,6,99,0,0,5"
+    ... ).split(",")
+    >>> pipeline = Pipeline(program, [9, 8, 7, 6, 5], feedback=True)
+    >>> pipeline.run()
+    139629729
+    >>> sum(stage["num_stalls"] for stage in pipeline.report()["stages"]) > 0
+    True
+
+    >>> Pipeline(["3", "7", "3", "7", "3", "7", "99", "0"], [1, 2]).run()
+    ... # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    DeadlockError: Every unfinished stage is waiting: stage_0, stage_1
+    """
+
+    def __init__(
+        self,
+        command_list: List[str],
+        phases: Sequence[int],
+        feedback: bool = False,
+        buffer_size: int = 16,
+        time_slice: int = 1000,
+    ):
+        if buffer_size < 2:
+            raise ValueError("buffer_size must fit the phase setting and first input")
+        self.feedback: bool = feedback
+        self.time_slice: int = time_slice
+        # buffers[i] is the input of stage i, without feedback there's one extra for the
+        # output of the last stage
+        num_buffers: int = len(phases) if feedback else len(phases) + 1
+        self.buffers: List[RingBuffer] = [
+            RingBuffer(buffer_size) for _ in range(num_buffers)
+        ]
+        self.stages: List[PipelineStage] = []
+        for i, phase in enumerate(phases):
+            self.buffers[i].write(phase)
+            program = IntCodeProgram(
+                command_list,
+                output_sink=self.buffers[(i + 1) % num_buffers],
+                input_source=self.buffers[i],
+            )
+            self.stages.append(PipelineStage(f"stage_{i}", program))
+        self.buffers[0].write(0)
+        self.outputs: List[int] = []
+        self.wall_seconds: float = 0.0
+
+    @property
+    def num_instructions(self) -> int:
+        return sum(stage.program.num_instructions for stage in self.stages)
+
+    def run(self) -> Optional[int]:
+        """Run every stage until they all exit, return the last output
+
+        Ready stages take turns running up to `time_slice` instructions each.
+        """
+        start: float = time.perf_counter()
+        try:
+            while True:
+                ready = [stage for stage in self.stages if stage.is_ready()]
+                if not ready:
+                    break
+                for stage in ready:
+                    stage.run(self.time_slice)
+                    if not self.feedback:
+                        self._collect(self.buffers[-1])
+        finally:
+            self.wall_seconds += time.perf_counter() - start
+        waiting = [stage.name for stage in self.stages if not stage.program.is_complete]
+        if waiting:
+            raise DeadlockError(
+                f"Every unfinished stage is waiting: {', '.join(waiting)}"
+            )
+        if self.feedback:
+            self._collect(self.buffers[0])
+        return self.outputs[-1] if self.outputs else None
+
+    def _collect(self, buffer: RingBuffer) -> None:
+        while not buffer.is_empty():
+            self.outputs.append(buffer.read())
+
+    def report(self) -> Dict[str, Any]:
+        """Throughput of the whole pipeline and time each stage spent stalled"""
+        num_instructions: int = self.num_instructions
+        return {
+            "wall_seconds": self.wall_seconds,
+            "num_instructions": num_instructions,
+            "instructions_per_second": (
+                num_instructions / self.wall_seconds if self.wall_seconds else 0.0
+            ),
+            "stages": [
+                {
+                    "name": stage.name,
+                    "num_instructions": stage.program.num_instructions,
+                    "stall_seconds": stage.stall_seconds,
+                    "num_stalls": stage.num_stalls,
+                }
+                for stage in self.stages
+            ],
+        }
+
+
+def best_permutation(
+    command_list: List[str],
+    phases: Sequence[int],
+    feedback: bool = False,
+    workers: int = 1,
+    buffer_size: int = 16,
+) -> Tuple[int, Tuple[int, ...], Dict[str, Any]]:
+    """Run a pipeline for every ordering of the phases, in a process pool if there is
+    more than 1 worker, and return the highest signal with its phases and a report
+
+    The report sums each stage's stalls by its place in the pipeline.
+
+    >>> program = "3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0".split(",")
+    >>> signal, phases, report = best_permutation(program, range(5), workers=2)
+    >>> signal, phases, report["num_pipelines"], report["num_instructions"]
+    (43210, (4, 3, 2, 1, 0), 120, 3600)
+
+    >>> program = (
+    ...     "3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,4,27,"
+    ...     "1001,28,-1,28,1005,28,6,99,0,0,5"
+    ... ).split(",")
+    >>> signal, phases, report = best_permutation(program, range(5, 10), feedback=True)
+    >>> signal, [stage["name"] for stage in report["stages"]]
+    (139629729, ['stage_0', 'stage_1', 'stage_2', 'stage_3', 'stage_4'])
+    >>> all((stage["num_stalls"] > 0 for stage in report["stages"]))
+    True
+    """
+    permutations: List[Tuple[int, ...]] = list(itertools.permutations(phases))
+    run_one = functools.partial(
+        _run_permutation, command_list, feedback=feedback, buffer_size=buffer_size
+    )
+    start: float = time.perf_counter()
+    if workers > 1:
+        chunk_size: int = max(1, len(permutations) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_one, permutations, chunksize=chunk_size))
+    else:
+        results = [run_one(permutation) for permutation in permutations]
+    wall_seconds: float = time.perf_counter() - start
+    best_index: int = max(range(len(results)), key=lambda i: results[i][0])
+    total_instructions: int = sum(result[1] for result in results)
+    report: Dict[str, Any] = {
+        "num_pipelines": len(results),
+        "wall_seconds": wall_seconds,
+        "num_instructions": total_instructions,
+        "instructions_per_second": (
+            total_instructions / wall_seconds if wall_seconds else 0.0
+        ),
+        "stages": [
+            {
+                "name": f"stage_{i}",
+                "stall_seconds": sum(result[2][i][0] for result in results),
+                "num_stalls": sum(result[2][i][1] for result in results),
+            }
+            for i in range(len(phases))
+        ],
+    }
+    return results[best_index][0], permutations[best_index], report
+
+
+def _run_permutation(
+    command_list: List[str],
+    phases: Tuple[int, ...],
+    feedback: bool,
+    buffer_size: int,
+) -> Tuple[int, int, List[Tuple[float, int]]]:
+    """Signal, instructions run, and each stage's stall time and number of stalls for
+    one ordering of the phases"""
+    pipeline = Pipeline(
+        command_list, phases, feedback=feedback, buffer_size=buffer_size
+    )
+    signal = pipeline.run()
+    stalls: List[Tuple[float, int]] = [
+        (stage.stall_seconds, stage.num_stalls) for stage in pipeline.stages
+    ]
+    return signal, pipeline.num_instructions, stalls
+
+
+def build_arg_parser() -> ArgumentParser:
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument(
+        "-i", "--input", help="Path for input file", default=DEFAULT_INPUT_FILE_PATH
+    )
+    arg_parser.add_argument("-r", "--run", help="Run the pipeline", action="store_true")
+    arg_parser.add_argument(
+        "-t", "--test", help="Run the tests for the pipeline", action="store_true"
+    )
+    arg_parser.add_argument(
+        "-p",
+        "--phases",
+        help="Comma separated phase settings to try every ordering of",
+        default="0,1,2,3,4",
+    )
+    arg_parser.add_argument(
+        "-f",
+        "--feedback",
+        help="Send the last stage's output back to the first stage",
+        action="store_true",
+    )
+    arg_parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="Number of processes to use"
+    )
+    arg_parser.add_argument(
+        "--buffer-size", type=int, default=16, help="Capacity of each stage's input"
+    )
+    return arg_parser
+
+
+def run(arg_parser: ArgumentParser) -> None:
+    args = arg_parser.parse_args()
+
+    if args.test:
+        print("Running Tests...")
+        failures, num_tests = doctest.testmod()
+        if not failures:
+            print(f"Ran {num_tests} test, 0 failures")
+        else:
+            return
+
+    if not args.test or args.run:
+        print("Parsing input...")
+        parsed_input = parse_input(Path(args.input))
+        if not parsed_input:
+            print("Could not parse input.")
+            return
+        phases: List[int] = [int(phase) for phase in args.phases.split(",")]
+        print("Running pipelines...")
+        signal, best_phases, report = best_permutation(
+            parsed_input,
+            phases,
+            feedback=args.feedback,
+            workers=args.workers,
+            buffer_size=args.buffer_size,
+        )
+        print(f"Best signal: {signal} from phases {best_phases}")
+        print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    parser = build_arg_parser()
+    run(parser)
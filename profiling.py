@@ -0,0 +1,140 @@
+"""Timing and profiling of the stages of a solution, shared by every day"""
+from argparse import ArgumentParser
+import cProfile
+from contextlib import contextmanager
+import json
+from pathlib import Path
+import sys
+import time
+import tracemalloc
+from typing import Dict, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def add_profiling_args(arg_parser: ArgumentParser) -> None:
+    arg_parser.add_argument(
+        "--timings",
+        help="Print a JSON report of the time and memory used by each stage",
+        action="store_true",
+    )
+    arg_parser.add_argument(
+        "--memory",
+        help="Trace the peak Python allocation of each stage, which slows it down",
+        action="store_true",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=".",
+        help="Save a cProfile stats file for each stage into this directory",
+    )
+
+
+class StageTimings:
+    """Measures each stage of a run, does nothing unless timings or profiling is on
+
+    Tracing memory or profiling slows a stage down several times over, so an
+    instrumented stage reports traced_wall_seconds instead of wall_seconds.
+
+    >>> timings = StageTimings("day_0", enabled=True)
+    >>> with timings.stage("part_1"):
+    ...     _ = [0] * 100000
+    >>> report = json.loads(timings.to_json())
+    >>> report["day"], sorted(report["stages"]["part_1"])
+    ('day_0', ['peak_rss_kb', 'wall_seconds'])
+    >>> timings = StageTimings("day_0", trace_memory=True)
+    >>> with timings.stage("part_1"):
+    ...     _ = [0] * 100000
+    >>> timings.stages["part_1"]["tracemalloc_peak_bytes"] >= 800000
+    True
+    >>> "wall_seconds" in timings.stages["part_1"]
+    False
+    >>> with StageTimings("day_0").stage("parse"):
+    ...     pass
+    """
+
+    def __init__(
+        self,
+        day: str,
+        enabled: bool = False,
+        profile_dir: Optional[str] = None,
+        trace_memory: bool = False,
+    ):
+        self.day: str = day
+        self.enabled: bool = enabled or trace_memory or profile_dir is not None
+        self.profile_dir: Optional[Path] = Path(profile_dir) if profile_dir else None
+        self.trace_memory: bool = trace_memory
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def from_args(cls, day: str, args) -> "StageTimings":
+        return cls(
+            day,
+            enabled=args.timings,
+            profile_dir=args.profile,
+            trace_memory=args.memory,
+        )
+
+    @property
+    def instrumented(self) -> bool:
+        """Whether stages run traced or profiled, so their times are inflated"""
+        return self.trace_memory or self.profile_dir is not None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        profiler: Optional[cProfile.Profile] = None
+        if self.profile_dir is not None:
+            profiler = cProfile.Profile()
+        if self.trace_memory:
+            tracemalloc.start()
+        start: float = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall_seconds: float = time.perf_counter() - start
+            stats: Dict[str, float] = {"peak_rss_kb": _peak_rss_kb()}
+            if self.trace_memory:
+                _, stats["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            if self.instrumented:
+                stats["traced_wall_seconds"] = wall_seconds
+            else:
+                stats["wall_seconds"] = wall_seconds
+            self.stages[name] = stats
+            if profiler is not None:
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(str(self.profile_dir / f"{self.day}_{name}.pstats"))
+
+    def to_json(self) -> str:
+        return json.dumps({"day": self.day, "stages": self.stages})
+
+    def report(self) -> None:
+        """Print the JSON report if enabled"""
+        if self.enabled:
+            print(self.to_json())
+
+
+def _peak_rss_kb() -> Optional[int]:
+    """Peak resident memory of this process so far, in kilobytes"""
+    if resource is None:
+        return None
+    max_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes where Linux reports kilobytes
+    return max_rss // 1024 if sys.platform == "darwin" else max_rss
+
+
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod()
@@ -0,0 +1,221 @@
+"""Base class for a day's solution, holding the run() boilerplate every day used to copy
+
+A day subclasses Solution, fills in parsing and the two parts, and calls main():
+
+    class Day6(Solution):
+        default_input_path = "input_6.txt"
+        part_1_budget = 0.5
+
+        def parse_record(self, record: str) -> int:
+            return int(record)
+
+        def main_1(self, parsed_input) -> int:
+            return sum(self.map_chunks(sum, parsed_input))
+
+    if __name__ == "__main__":
+        Day6.main()
+"""
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+import doctest
+from pathlib import Path
+import sys
+from typing import Any, Callable, Iterator, List, Optional, Sequence, TextIO
+
+from profiling import StageTimings, add_profiling_args
+
+
+class Solution:
+    """
+    >>> import tempfile
+    >>> class Doubler(Solution):
+    ...     part_1_budget = 10.0
+    ...     def parse_record(self, record):
+    ...         return int(record)
+    ...     def main_1(self, parsed_input):
+    ...         return sum(parsed_input) * 2
+    >>> input_path = Path(tempfile.mkdtemp()) / "input.txt"
+    >>> _ = input_path.write_text("1\\n2\\n\\n3\\n")
+    >>> timings = StageTimings("doubler", enabled=True)
+    >>> solution = Doubler(input_path, timings=timings)
+    >>> solution.parsed_input
+    [1, 2, 3]
+    >>> solution.parsed_input is solution.parsed_input
+    True
+    >>> solution.part_1(), solution.part_2()
+    (12, None)
+    >>> solution.over_budget()
+    []
+    >>> solution.part_1_budget = 0.0
+    >>> solution.over_budget()
+    ['part_1']
+    >>> traced = Doubler(input_path, timings=StageTimings("doubler", trace_memory=True))
+    >>> traced.part_1_budget = 0.0
+    >>> _ = traced.part_1()
+    >>> traced.over_budget()
+    []
+    """
+
+    # path used when --input isn't given
+    default_input_path: str = ""
+    # most seconds each part may take when run with --benchmark, None for no limit
+    part_1_budget: Optional[float] = None
+    part_2_budget: Optional[float] = None
+
+    def __init__(
+        self,
+        input_path: Path,
+        workers: int = 1,
+        timings: Optional[StageTimings] = None,
+    ):
+        self.input_path: Path = input_path
+        self.workers: int = workers
+        self.timings: StageTimings = timings or StageTimings(self.day_name())
+        self._parsed_input: Any = None
+        self._is_parsed: bool = False
+
+    @classmethod
+    def day_name(cls) -> str:
+        return Path(sys.modules[cls.__module__].__file__ or cls.__name__).stem
+
+    @property
+    def parsed_input(self) -> Any:
+        """Input parsed on first use and kept for every later use"""
+        if not self._is_parsed:
+            with self.timings.stage("parse"):
+                self._parsed_input = self.parse_input(self.input_path)
+            self._is_parsed = True
+        return self._parsed_input
+
+    def parse_input(self, input_path: Path) -> Any:
+        """Parse the whole input, by default a list of parse_record for each record
+
+        Override this for input that isn't made of independent records.
+        """
+        if not input_path.exists():
+            print(f"Bad input path. '{input_path}' does not exist.")
+            return []
+        with input_path.open() as input_file:
+            return [
+                self.parse_record(record) for record in self.iter_records(input_file)
+            ]
+
+    def iter_records(self, input_file: TextIO) -> Iterator[str]:
+        """Split the input into records to parse one at a time, by default lines"""
+        for line in input_file:
+            stripped_line: str = line.strip()
+            if stripped_line:
+                yield stripped_line
+
+    def parse_record(self, record: str) -> Any:
+        return record
+
+    def main_1(self, parsed_input) -> Any:
+        return None
+
+    def main_2(self, parsed_input) -> Any:
+        return None
+
+    def part_1(self) -> Any:
+        parsed_input = self.parsed_input
+        with self.timings.stage("part_1"):
+            return self.main_1(parsed_input)
+
+    def part_2(self) -> Any:
+        parsed_input = self.parsed_input
+        with self.timings.stage("part_2"):
+            return self.main_2(parsed_input)
+
+    def map_chunks(self, func: Callable[[Sequence], Any], items: Sequence) -> List[Any]:
+        """Call func on each of `workers` balanced chunks of items, in a process pool if
+        there is more than 1 worker, so func must be a module level function
+
+        >>> Solution(Path(), workers=3).map_chunks(sum, list(range(10)))
+        [6, 15, 24]
+        >>> Solution(Path()).map_chunks(len, [1, 2, 3])
+        [3]
+        """
+        num_chunks: int = max(1, min(self.workers, len(items)))
+        chunk_size, extra = divmod(len(items), num_chunks)
+        chunks: List[Sequence] = []
+        start: int = 0
+        for i in range(num_chunks):
+            end = start + chunk_size + (1 if i < extra else 0)
+            chunks.append(items[start:end])
+            start = end
+        if num_chunks == 1:
+            return [func(chunk) for chunk in chunks]
+        with ProcessPoolExecutor(max_workers=num_chunks) as executor:
+            return list(executor.map(func, chunks))
+
+    def over_budget(self) -> List[str]:
+        """Names of the parts whose last untraced run took longer than their budget"""
+        over: List[str] = []
+        budgets = (("part_1", self.part_1_budget), ("part_2", self.part_2_budget))
+        for part, budget in budgets:
+            # instrumented stages only have traced_wall_seconds, never compared
+            wall_seconds = self.timings.stages.get(part, {}).get("wall_seconds")
+            if budget is not None and wall_seconds is not None:
+                if wall_seconds > budget:
+                    over.append(part)
+        return over
+
+    @classmethod
+    def build_arg_parser(cls) -> ArgumentParser:
+        arg_parser = ArgumentParser()
+        arg_parser.add_argument(
+            "-i", "--input", help="Path for input file", default=cls.default_input_path
+        )
+        arg_parser.add_argument(
+            "-r", "--run", help="Run the solution", action="store_true"
+        )
+        arg_parser.add_argument(
+            "-t", "--test", help="Run the tests for this solution", action="store_true"
+        )
+        arg_parser.add_argument(
+            "-w", "--workers", type=int, default=1, help="Number of processes to use"
+        )
+        arg_parser.add_argument(
+            "-b",
+            "--benchmark",
+            help="Time both parts and exit with an error if either is over budget",
+            action="store_true",
+        )
+        add_profiling_args(arg_parser)
+        return arg_parser
+
+    @classmethod
+    def main(cls, argv: Optional[List[str]] = None) -> None:
+        arg_parser: ArgumentParser = cls.build_arg_parser()
+        args: Namespace = arg_parser.parse_args(argv)
+        if args.benchmark and (args.memory or args.profile):
+            arg_parser.error(
+                "--benchmark needs untraced times, drop --memory/--profile"
+            )
+
+        if args.test:
+            print("Running Tests...")
+            failures, num_tests = doctest.testmod(sys.modules[cls.__module__])
+            if not failures:
+                print(f"Ran {num_tests} test, 0 failures")
+            else:
+                return
+
+        if not args.test or args.run or args.benchmark:
+            timings = StageTimings.from_args(cls.day_name(), args)
+            timings.enabled = timings.enabled or args.benchmark
+            solution = cls(Path(args.input), workers=args.workers, timings=timings)
+            print("Parsing input...")
+            if not solution.parsed_input:
+                print("Could not parse input.")
+                return
+            print("Computing answer for part 1...")
+            print(f"Answer for part 1: {solution.part_1()}")
+            print("Computing answer for part 2...")
+            print(f"Answer for part 2: {solution.part_2()}")
+            timings.report()
+            if args.benchmark:
+                over = solution.over_budget()
+                if over:
+                    print(f"Over budget: {', '.join(over)}")
+                    sys.exit(1)